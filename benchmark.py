@@ -0,0 +1,200 @@
+"""
+Naam: Simon Plas, Boris Vukaljovic
+UvAID: 15249514, 15225054
+Description:
+This file times the hot paths of the simulation: run_match, run_tournament,
+evaluate_individual and genetic_algorithm_step, over growing numbers of
+rounds, strategies and individuals, and genetic_algorithm on every executor.
+It reports matches and rounds per second.
+
+Results are stored in a JSON file keyed by the git commit, and compared
+against the results of a baseline commit: a case slower than the baseline by
+more than the threshold is a regression, and the script then exits with 1.
+
+The default grid goes up to 10^5 rounds and individuals and 500 strategies
+and runs in a few minutes. With --soak the grid grows a step further and
+every case is repeated more, for runs of an hour or so.
+
+Examples:
+  python3 benchmark.py
+  python3 benchmark.py --baseline 3a4f87f --threshold 0.1
+  python3 benchmark.py --soak --output soak.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from ipd_simulation.strategies import non_genetic_strategies
+from ipd_simulation.match_tournament import run_match, run_tournament
+from ipd_simulation.genetic_backend import (PopulationEvaluator, evaluate_individual, genetic_algorithm,
+                                            genetic_algorithm_step, make_genetic_strategy, random_individual,
+                                            random_population)
+
+# Sizes of the grids, the soak grid contains the default one
+GRIDS = {
+    "default": {
+        "match_rounds": [200, 1000, 10000, 100000],
+        "tournament_strategies": [10, 50, 100, 500],
+        "individual_rounds": [200, 1000, 10000, 100000],
+        "population_sizes": [100, 1000, 10000, 100000],
+    },
+    "soak": {
+        "match_rounds": [200, 1000, 10000, 100000, 1000000],
+        "tournament_strategies": [10, 50, 100, 500, 1000],
+        "individual_rounds": [200, 1000, 10000, 100000, 1000000],
+        "population_sizes": [100, 1000, 10000, 100000, 300000],
+    },
+}
+
+# Rounds of the matches in tournaments and generations
+ROUNDS = 200
+
+# Population and generations of the genetic_algorithm cases
+GA_POPULATION = 1000
+GA_GENERATIONS = 3
+
+
+# Times a function: the best of a number of repeats, in seconds
+def best_time(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# A case result with the derived throughputs
+def result(seconds, matches, rounds):
+    return {
+        "seconds": seconds,
+        "matches_per_second": matches / seconds,
+        "rounds_per_second": matches * rounds / seconds,
+    }
+
+
+# The non-genetic strategies, completed with random genetic strategies up to
+# the requested number
+def strategy_pool(count):
+    strategies = dict(non_genetic_strategies)
+    for i in range(count - len(strategies)):
+        strategies[f"Genetic {i}"] = make_genetic_strategy(random_individual())
+    return dict(list(strategies.items())[:count])
+
+
+# Every case of the grid as (name, function, matches, rounds)
+def benchmark_cases(grid):
+    # A stochastic pair plays every round, a deterministic pair ends up in a
+    # cycle that run_match skips
+    genetic = make_genetic_strategy(random_individual())
+    pairs = {
+        "stochastic": (non_genetic_strategies["Tit for Tat"], non_genetic_strategies["Random Strategy"]),
+        "cycling": (genetic, non_genetic_strategies["Adaptive Ratio"]),
+    }
+    for rounds in grid["match_rounds"]:
+        for pair, (strategy_A, strategy_B) in pairs.items():
+            yield (f"run_match/{pair}/rounds={rounds}",
+                   lambda a=strategy_A, b=strategy_B, r=rounds: run_match(a, b, r, keep_history=None), 1, rounds)
+
+    for count in grid["tournament_strategies"]:
+        strategies = strategy_pool(count)
+        yield (f"run_tournament/strategies={count}",
+               lambda s=strategies: run_tournament(s, ROUNDS), count * (count - 1) // 2, ROUNDS)
+
+    individual = random_individual()
+    for rounds in grid["individual_rounds"]:
+        yield (f"evaluate_individual/rounds={rounds}",
+               lambda r=rounds: evaluate_individual(individual, non_genetic_strategies, r),
+               len(non_genetic_strategies), rounds)
+
+    for size in grid["population_sizes"]:
+        population = random_population(size)
+        yield (f"genetic_algorithm_step/population={size}",
+               lambda p=population: genetic_algorithm_step(p, non_genetic_strategies, ROUNDS, 0.05, 0.15),
+               size * len(non_genetic_strategies), ROUNDS)
+
+    # The whole algorithm over every executor, a few generations each
+    for executor in PopulationEvaluator.EXECUTORS:
+        yield (f"genetic_algorithm/executor={executor}",
+               lambda e=executor: genetic_algorithm(non_genetic_strategies, GA_POPULATION, GA_GENERATIONS, ROUNDS,
+                                                    0.05, 0.15, executor=e, workers=2,
+                                                    progress=lambda generation, fitness: False),
+               GA_POPULATION * GA_GENERATIONS * len(non_genetic_strategies), ROUNDS)
+
+
+# The commit the benchmark runs on, marked when the tree has changes
+def current_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        changed = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                                 text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + "-dirty" if changed else commit
+
+
+# Cases of the results that are slower than the baseline by more than the
+# threshold, as (name, baseline seconds, seconds)
+def regressions(results, baseline, threshold):
+    slower = []
+    for name, case in results.items():
+        if name in baseline and case["seconds"] > baseline[name]["seconds"] * (1 + threshold):
+            slower.append((name, baseline[name]["seconds"], case["seconds"]))
+    return slower
+
+
+# Runs the benchmark and compares it with the baseline
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the match, tournament and genetic algorithm hot paths.")
+    parser.add_argument("--soak", action="store_true", help="run the large grid with more repeats")
+    parser.add_argument("--repeat", type=int, default=None, help="repeats per case, the best is kept")
+    parser.add_argument("--output", default="benchmarks.json", help="JSON file with the results per commit")
+    parser.add_argument("--baseline", default=None, help="commit in the output file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 is 20 percent")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    arguments = parser.parse_args()
+
+    grid = GRIDS["soak" if arguments.soak else "default"]
+    repeat = arguments.repeat or (10 if arguments.soak else 3)
+
+    # The same strategies and populations on every run
+    random.seed(0)
+
+    commit = current_commit()
+    results = {}
+    print(f"Benchmarking commit {commit}")
+    for name, function, matches, rounds in benchmark_cases(grid):
+        if arguments.filter not in name:
+            continue
+        results[name] = result(best_time(function, repeat), matches, rounds)
+        print(f"{name:45} {results[name]['seconds']:10.4f} s {results[name]['matches_per_second']:12.1f} matches/s "
+              f"{results[name]['rounds_per_second']:14.0f} rounds/s")
+
+    # Store the results next to those of other commits
+    stored = {}
+    if os.path.exists(arguments.output):
+        with open(arguments.output) as f:
+            stored = json.load(f)
+    stored.setdefault(commit, {}).update(results)
+    with open(arguments.output, "w") as f:
+        json.dump(stored, f, indent=2, sort_keys=True)
+
+    if arguments.baseline is None:
+        return 0
+    if arguments.baseline not in stored:
+        print(f"Baseline commit {arguments.baseline} not found in {arguments.output}")
+        return 1
+    slower = regressions(results, stored[arguments.baseline], arguments.threshold)
+    for name, baseline_seconds, seconds in slower:
+        print(f"Regression in {name}: {baseline_seconds:.4f} s -> {seconds:.4f} s")
+    if not slower:
+        print(f"No regressions against {arguments.baseline} beyond {arguments.threshold:.0%}")
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,7 +16,7 @@ Three graphs are generated:
    In graph 3, bars are colored based on the mutation rate.
 """
 import matplotlib.pyplot as plt
-from ipd_simulation.simulation_gui import IPDSimulation
+from ipd_simulation.simulation import IPDSimulation
 
 # Initial configuration for the genetic algorithm
 init_params = {
@@ -26,6 +26,8 @@ init_params = {
     "num_generations": 50,
     "mutation_rate": 0.05,
     "survivor_fraction": 0.15,
+    "racing": True,
+    "common_random_numbers": True,
     "strategy_A": "Tit for Tat",
     "strategy_B": "Always Defect",
 }
@@ -0,0 +1,56 @@
+"""
+Naam: Simon Plas, Boris Vukaljovic
+UvAID: 15249514, 15225054
+Description:
+Implements the checkpoint file of a simulation: a versioned NumPy archive
+holding the packed genome matrix, the fitness history, the parameters and
+the state of the random module, so a run can be continued bit-identically.
+"""
+import json
+import os
+import random
+import numpy
+
+# Version of the checkpoint format, files of other versions are refused
+CHECKPOINT_VERSION = 1
+
+
+# The state of the random module as arrays. The Mersenne Twister state is
+# 624 words and a position, all below 2**32
+def random_state():
+    version, internal, gauss_next = random.getstate()
+    return {
+        "random_version": numpy.array(version),
+        "random_internal": numpy.array(internal, dtype=numpy.uint32),
+        "random_gauss": numpy.array(numpy.nan if gauss_next is None else gauss_next),
+    }
+
+
+# Restores the random module from the arrays of random_state
+def restore_random_state(state):
+    gauss_next = float(state["random_gauss"])
+    random.setstate((int(state["random_version"]),
+                     tuple(int(word) for word in state["random_internal"]),
+                     None if numpy.isnan(gauss_next) else gauss_next))
+
+
+# Writes the arrays of a state to a checkpoint. Values that are not arrays
+# (parameters, phase) are stored together as JSON text. The file is replaced
+# only once it has been written completely
+def write_checkpoint(path, arrays, values):
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        numpy.savez_compressed(f, version=numpy.array(CHECKPOINT_VERSION),
+                               values=numpy.array(json.dumps(values)), **arrays)
+    os.replace(temporary, path)
+
+
+# Reads a checkpoint and returns its arrays and values
+def read_checkpoint(path):
+    with numpy.load(path, allow_pickle=False) as archive:
+        version = int(archive["version"])
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f"Checkpoint '{path}' has version {version}, expected {CHECKPOINT_VERSION}")
+        arrays = {name: archive[name] for name in archive.files if name not in ("version", "values")}
+        values = json.loads(str(archive["values"]))
+    return arrays, values
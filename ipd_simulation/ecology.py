@@ -0,0 +1,129 @@
+"""
+Naam: Simon Plas, Boris Vukaljovic
+UvAID: 15249514, 15225054
+Description:
+Implements ecological dynamics of strategy populations, the replicator
+equation and the finite-population Moran and Wright-Fisher processes, on top
+of a table of pairwise payoffs built by a single tournament.
+"""
+import bisect
+import itertools
+import numpy
+from ipd_simulation.match_tournament import run_match, run_tournament
+
+# Dynamics of the ecology, see replicator_step, moran_step and
+# wright_fisher_step
+DYNAMICS = ("Replicator", "Moran", "Wright-Fisher")
+
+
+# Average payoff per round of every strategy (row) against every strategy
+# (column), including against itself. Only this tournament is played, the
+# dynamics below reuse the table
+def payoff_table(strategies, rounds, workers=1):
+    _, table = run_tournament(strategies, rounds, workers, return_matrix=True)
+
+    # A strategy also meets its own kind in a population
+    for i, strategy in enumerate(strategies.values()):
+        table[i, i] = run_match(strategy, strategy, rounds, keep_history=None)[2]
+
+    return table / rounds
+
+
+# One generation of the discrete replicator equation: every share grows in
+# proportion to its fitness against the current population
+def replicator_step(shares, table):
+    fitness = table @ shares
+    mean_fitness = shares @ fitness
+    if mean_fitness <= 0:
+        return shares
+    return shares * fitness / mean_fitness
+
+
+# Runs the replicator equation for a number of generations and returns the
+# shares of every generation, starting with the given shares
+def replicator_dynamics(shares, table, generations):
+    trajectory = numpy.empty((generations + 1, len(shares)))
+    trajectory[0] = shares
+    for generation in range(generations):
+        trajectory[generation + 1] = replicator_step(trajectory[generation], table)
+    return trajectory
+
+
+# One generation of the Moran process on the counts of every strategy: as
+# many birth-death events as there are individuals. In every event an
+# individual reproduces with probability proportional to its fitness against
+# the other individuals, and its offspring replaces a random individual.
+#
+# The events are kept exact, so every event sees the counts left by the one
+# before it and a generation costs time in proportion to the population. The
+# draws of all events are made at once, and an event only updates the payoff
+# totals with the table columns of the strategies born and died. For large
+# populations over many generations see wright_fisher_step
+def moran_step(counts, table, rng):
+    population_size = int(counts.sum())
+    if population_size < 2:
+        return counts.copy()
+
+    # Small vectors are cheaper to update as lists than as arrays
+    draws = rng.random((population_size, 2)).tolist()
+    columns = table.T.tolist()
+    self_payoffs = numpy.diag(table).tolist()
+    totals = (table @ counts).tolist()
+    current = counts.tolist()
+    for birth_draw, death_draw in draws:
+        # Fitness against the others, without the common 1 / (N - 1)
+        weights = list(itertools.accumulate(max(count * (total - self_payoff), 0.0)
+                                            for count, total, self_payoff in zip(current, totals, self_payoffs)))
+        if weights[-1] <= 0:
+            weights = list(itertools.accumulate(current))
+        parent = bisect.bisect_right(weights, birth_draw * weights[-1])
+        dying = bisect.bisect_right(list(itertools.accumulate(current)), death_draw * population_size)
+        if parent != dying:
+            current[parent] += 1
+            current[dying] -= 1
+            totals = [total + born - died for total, born, died in zip(totals, columns[parent], columns[dying])]
+
+    return numpy.array(current, dtype=counts.dtype)
+
+
+# One generation of the Wright-Fisher process: the whole population is
+# replaced at once by offspring of parents picked with probability
+# proportional to their fitness against the other individuals. A generation
+# is a single multinomial draw, whatever the size of the population
+def wright_fisher_step(counts, table, rng):
+    population_size = int(counts.sum())
+    if population_size < 2:
+        return counts.copy()
+
+    fitness = (table @ counts - numpy.diag(table)) / (population_size - 1)
+    weights = numpy.maximum(counts * fitness, 0)
+    if weights.sum() <= 0:
+        weights = counts.astype(float)
+    return rng.multinomial(population_size, weights / weights.sum()).astype(counts.dtype)
+
+
+# Runs the Moran process for a number of generations and returns the counts
+# of every generation, starting with the given counts
+def moran_dynamics(counts, table, generations, rng):
+    trajectory = numpy.empty((generations + 1, len(counts)), dtype=counts.dtype)
+    trajectory[0] = counts
+    for generation in range(generations):
+        trajectory[generation + 1] = moran_step(trajectory[generation], table, rng)
+    return trajectory
+
+
+# Runs the Wright-Fisher process for a number of generations and returns the
+# counts of every generation, starting with the given counts
+def wright_fisher_dynamics(counts, table, generations, rng):
+    trajectory = numpy.empty((generations + 1, len(counts)), dtype=counts.dtype)
+    trajectory[0] = counts
+    for generation in range(generations):
+        trajectory[generation + 1] = wright_fisher_step(trajectory[generation], table, rng)
+    return trajectory
+
+
+# Splits a population as evenly as possible over a number of strategies
+def even_counts(population_size, strategy_count):
+    counts = numpy.full(strategy_count, population_size // strategy_count)
+    counts[:population_size % strategy_count] += 1
+    return counts
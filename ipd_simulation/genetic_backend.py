@@ -5,9 +5,18 @@ Description:
 Implements the genetic algorithm for evolving strategies, with the means of
 mutation, crossover, and selection mechanisms.
 """
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import os
 import random
-from ipd_simulation.strategies import COOPERATE, DEFECT
-from ipd_simulation.match_tournament import run_match
+import threading
+from collections import OrderedDict
+import numpy
+from ipd_simulation.strategies import COOPERATE, DEFECT, finite_memory, payoff_matrix, vectorized_strategies
+from ipd_simulation.match_tournament import is_finite_memory, run_match, run_batch_match
+from ipd_simulation.instrumentation import counted, instruments
 
 
 # Generates all possible sequences of length of n of COOPERATE and DEFECT
@@ -28,43 +37,532 @@ def all_combinations(n):
     return combos
 
 
-# Creates a random strategy
-def random_individual():
-    # Random opening for the first three moves
-    opening = [random.choice([COOPERATE, DEFECT]) for _ in range(3)]
+# Genomes are stored as bit-packed bytes with one bit per gene, 0 for
+# COOPERATE and 1 for DEFECT. For a memory depth n the first n bits are the
+# opening, followed by a rule table of 4 ** n bits. The rule table is indexed
+# by a 2n-bit state in which the upper n bits are my last n moves and the
+# lower n bits the opponent's, with the oldest move in the most significant
+# position (same order as all_combinations). The memory depth of a genome
+# follows from its length, see genome_memory.
+MEMORY = 3
+
+MOVE_BITS = {COOPERATE: 0, DEFECT: 1}
+BIT_MOVES = (COOPERATE, DEFECT)
+
+
+# Number of genes of a genome with the given memory depth
+def genome_length(memory=MEMORY):
+    return memory + 4 ** memory
+
+
+# Number of bytes of a bit-packed genome with the given memory depth
+def genome_bytes(memory=MEMORY):
+    return (genome_length(memory) + 7) // 8
+
+
+# Memory depth of a genome, or of the genomes in a population matrix
+def genome_memory(genome):
+    size = genome.shape[-1] if isinstance(genome, numpy.ndarray) else len(genome)
+    memory = 1
+    while genome_bytes(memory) < size:
+        memory += 1
+    if genome_bytes(memory) != size:
+        raise ValueError("Invalid genome of " + str(size) + " bytes")
+    return memory
+
+
+# Mask that keeps all but the oldest move of both players when shifting the
+# state index one move
+def state_mask(memory=MEMORY):
+    return ((1 << 2 * memory) - 1) ^ (1 << memory) ^ 1
+
+
+# Packs a sequence of genes into a genome
+def pack_genome(genes):
+    return numpy.packbits(numpy.asarray(genes, dtype=numpy.uint8)).tobytes()
 
-    rule_table = {}
 
-    # Generate all possible histories for self and opponent
-    my_combinations = all_combinations(3)
-    opponent_combinations = all_combinations(3)
+# Unpacks a genome into a list of genes
+def unpack_genome(genome):
+    genes = numpy.unpackbits(numpy.frombuffer(bytes(genome), dtype=numpy.uint8))
+    return genes[:genome_length(genome_memory(genome))].tolist()
 
-    # Assign a random response for each combination of history
-    for my_moves in my_combinations:
-        for opponent_moves in opponent_combinations:
-            rule_table[(my_moves, opponent_moves)] = random.choice([COOPERATE, DEFECT])
+
+# Converts a dict individual ({"opening": [...], "rule_table": {...}}) to a
+# compact genome
+def encode_individual(individual):
+    memory = len(individual['opening'])
+    genes = [MOVE_BITS[move] for move in individual['opening']]
+
+    for key in history_keys(memory):
+        genes.append(MOVE_BITS[individual['rule_table'].get(key, COOPERATE)])
+
+    return pack_genome(genes)
+
+
+# Converts a compact genome back to the dict form, e.g. for exporting
+def decode_individual(genome):
+    memory = genome_memory(genome)
+    genes = unpack_genome(genome)
+    opening = [BIT_MOVES[bit] for bit in genes[:memory]]
+    rule_table = {}
+
+    for index, key in enumerate(history_keys(memory)):
+        rule_table[key] = BIT_MOVES[genes[memory + index]]
 
     return {"opening": opening, "rule_table": rule_table}
 
 
-# Converts a rule table into a fuction
+# All (my_moves, opponent_moves) keys of the rule table in genome order
+def history_keys(memory=MEMORY):
+    combinations = all_combinations(memory)
+    return [(my_moves, opponent_moves) for my_moves in combinations
+            for opponent_moves in combinations]
+
+
+# Computes the state index from the last moves of both players
+def state_index(my_last_moves, opponent_last_moves):
+    index = 0
+    for move in my_last_moves:
+        index = (index << 1) | MOVE_BITS[move]
+    for move in opponent_last_moves:
+        index = (index << 1) | MOVE_BITS[move]
+    return index
+
+
+# Creates a random strategy
+def random_individual(memory=MEMORY):
+    # Random opening for the first moves, followed by a random response for
+    # each combination of history
+    return pack_genome([random.choice((0, 1)) for _ in range(genome_length(memory))])
+
+
+# Evolved strategy playing a genome. Implements both the incremental protocol,
+# where the state index is shifted with the last moves every round, and the
+# history protocol of the non-genetic strategies
+@finite_memory(MEMORY)
+class GeneticStrategy:
+    def __init__(self, genome):
+        self.genome = genome
+        self.memory = self.warmup = self.markov_memory = genome_memory(genome)
+        self.mask = state_mask(self.memory)
+
+        genes = unpack_genome(genome)
+        self.opening = [BIT_MOVES[bit] for bit in genes[:self.memory]]
+        self.rule_table = [BIT_MOVES[bit] for bit in genes[self.memory:]]
+        self.reset()
+
+    def reset(self):
+        self.index = 0
+        self.round_number = 0
+
+    def move(self, last_own, last_opponent):
+        round_number = self.round_number
+        self.round_number += 1
+
+        # After `memory` rounds the index holds the last moves of both
+        if round_number > 0:
+            self.index = (((self.index << 1) & self.mask)
+                          | (MOVE_BITS[last_own] << self.memory)
+                          | MOVE_BITS[last_opponent])
+
+        # If less than `memory` rounds played use opening
+        if round_number < self.memory:
+            return self.opening[round_number]
+        return self.rule_table[self.index]
+
+    def __call__(self, my_history, opponent_history):
+        rounds = len(my_history)
+        if rounds < self.memory:
+            return self.opening[rounds]
+        return self.rule_table[state_index(my_history[-self.memory:], opponent_history[-self.memory:])]
+
+    # Probability of cooperating after the given last moves, see
+    # strategies.markov
+    def cooperation_probability(self, my_last, opponent_last):
+        return 1.0 if self(my_last, opponent_last) == COOPERATE else 0.0
+
+
+# Converts a genome (or a dict individual) into a strategy
 def make_genetic_strategy(individual):
-    def strategy(my_history, opponent_history):
-        # If less than 3 rounds played use opening
-        if len(my_history) < 3:
-            return individual['opening'][len(my_history)]
-
-        # Moves from myself and the opponent for the last 3 rounds
-        my_last_moves = (my_history[-3], my_history[-2], my_history[-1])
-        opponent_last_moves = (opponent_history[-3], opponent_history[-2], opponent_history[-1])
-
-        # If my last 3 moves and opponents last 3 moves are in the rule table
-        # then return the resulting next move
-        if (my_last_moves, opponent_last_moves) in individual['rule_table']:
-            return individual['rule_table'][(my_last_moves, opponent_last_moves)]
+    if isinstance(individual, dict):
+        individual = encode_individual(individual)
+    return GeneticStrategy(individual)
+
+
+# Stacks genomes into a (population size x genome bytes) matrix, populations
+# that already are a matrix are returned as is
+def population_matrix(population):
+    if isinstance(population, numpy.ndarray):
+        return population
+    size = len(population[0]) if len(population) else genome_bytes()
+    return numpy.frombuffer(b"".join(population), dtype=numpy.uint8).reshape(len(population), size)
+
+
+# NumPy generator for the population operators, seeded from the random module
+# so random.seed keeps runs reproducible
+def population_rng():
+    return numpy.random.default_rng(random.getrandbits(64))
+
+
+# Creates a population matrix of random strategies
+def random_population(population_size, memory=MEMORY):
+    genes = population_rng().integers(0, 2, (population_size, genome_length(memory)), dtype=numpy.uint8)
+    return numpy.packbits(genes, axis=1)
+
+
+# Vectorized genetic strategy playing one genome per match, see
+# strategies.vectorized_strategies for the protocol. Genes are read straight
+# from the bit-packed population matrix
+class VectorGeneticStrategy:
+    def __init__(self, genomes):
+        self.genomes = genomes
+        self.memory = genome_memory(genomes)
+        self.mask = state_mask(self.memory)
+
+    def reset(self, size):
+        self.rows = numpy.arange(size)
+        self.index = numpy.zeros(size, dtype=numpy.intp)
+        self.round_number = 0
+
+    def gene(self, position):
+        bits = self.genomes[self.rows, position >> 3] >> (7 - (position & 7))
+        return (bits & 1).astype(numpy.uint8)
+
+    def move(self, my_last, opponent_last):
+        round_number = self.round_number
+        self.round_number += 1
+
+        # The state index is shifted every round, after `memory` rounds it
+        # holds the last moves of both players
+        if round_number > 0:
+            self.index = (((self.index << 1) & self.mask)
+                          | (my_last.astype(numpy.intp) << self.memory)
+                          | opponent_last)
+
+        if round_number < self.memory:
+            return self.gene(round_number)
+        return self.gene(self.memory + self.index)
+
+
+# Least recently used cache of match scores, keyed by genome, opponent, number
+# of rounds and payoff matrix
+class ScoreCache:
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, score):
+        self.entries[key] = score
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Seeds of the common random numbers of a generation, one per stochastic
+# opponent. They are drawn from the random module, so random.seed keeps runs
+# reproducible
+def common_seeds(opponents):
+    return {name: random.getrandbits(64) for name, opponent in opponents.items()
+            if not getattr(opponent, 'deterministic', False)}
+
+
+# The common random numbers of a seed, one uniform number per round
+def common_draws(seed, rounds):
+    return numpy.random.default_rng(seed).random(rounds)
+
+
+# Held while a match runs on the seeded random module, see play_population
+common_random_lock = threading.Lock()
+
+
+# Plays every individual against the opponent and returns the array of scores.
+# Opponents with a vectorized equivalent play all individuals in lock-step,
+# other opponents fall back to a match per individual.
+#
+# With a seed a stochastic opponent meets every individual with the same
+# random numbers: vectorized opponents share the draws of the seed, other
+# opponents get the random module seeded with it at the start of every match.
+# Opponents call the shared random module rather than a generator of their
+# own, so those matches hold common_random_lock; threads of the thread
+# executor then cannot draw from each other's seeded streams
+def play_population(population, opponent, rounds, seed=None):
+    if len(population) == 0:
+        return numpy.zeros(0)
+    if opponent in vectorized_strategies:
+        if seed is None:
+            batch = vectorized_strategies[opponent]()
         else:
-            return COOPERATE
-    return strategy
+            batch = vectorized_strategies[opponent](common_draws(seed, rounds))
+        scores, _ = run_batch_match(VectorGeneticStrategy(population_matrix(population)), batch,
+                                    len(population), rounds)
+        return scores
+    if seed is None:
+        return numpy.array([run_match(make_genetic_strategy(individual), opponent, rounds, keep_history=None)[2]
+                            for individual in population])
+
+    scores = []
+    with common_random_lock:
+        state = random.getstate()
+        try:
+            for individual in population:
+                random.seed(seed)
+                scores.append(run_match(make_genetic_strategy(individual), opponent, rounds, keep_history=None)[2])
+        finally:
+            random.setstate(state)
+    return numpy.array(scores)
+
+
+# Opponents of the process pool workers, set once when a worker starts
+worker_opponents = None
+
+
+def init_worker(opponents):
+    global worker_opponents
+    worker_opponents = opponents
+    # Forked workers inherit the random state, give each its own stream
+    random.seed()
+
+
+# Plays one chunk of genomes against an opponent in a process pool worker
+def play_chunk(task):
+    name, chunk, rounds, matrix, seed, instrumented = task
+    if matrix != payoff_matrix:
+        payoff_matrix.clear()
+        payoff_matrix.update(matrix)
+    return counted(instrumented, play_population, chunk, worker_opponents[name], rounds, seed)
+
+
+# Plays populations against opponents either serially or split into chunks
+# over a pool of threads or processes. The pool is started on first use and
+# reused until the opponent set changes or close() is called
+class PopulationEvaluator:
+    EXECUTORS = ("serial", "thread", "process")
+
+    def __init__(self, executor="serial", workers=0):
+        if executor not in self.EXECUTORS:
+            raise ValueError("Invalid executor '" + str(executor) + "'. Use one of " + str(self.EXECUTORS))
+        self.executor = executor
+        self.workers = workers
+        self.pool_size = workers or os.cpu_count()
+        self.pool = None
+        self.pool_opponents = None
+
+    # Plays every (opponent name, individuals) pair in `matches` and returns
+    # the list of score arrays. seeds holds the common random numbers of the
+    # opponents that have them, see play_population
+    def play(self, matches, opponents, rounds, seeds=None):
+        seeds = seeds or {}
+        if self.executor == "serial":
+            return [play_population(individuals, opponents[name], rounds, seeds.get(name))
+                    for name, individuals in matches]
+
+        self.start(opponents)
+
+        # Split every match into chunks of about equal size per worker
+        chunks = []
+        chunk_counts = []
+        for name, individuals in matches:
+            size = max(1, -(-len(individuals) // self.pool_size))
+            starts = range(0, len(individuals), size)
+            chunks.extend((name, individuals[i:i + size]) for i in starts)
+            chunk_counts.append(len(starts))
+
+        if self.executor == "thread":
+            results = self.pool.map(lambda chunk: play_population(chunk[1], opponents[chunk[0]], rounds,
+                                                                  seeds.get(chunk[0])),
+                                    chunks, chunksize=1)
+        else:
+            tasks = [(name, chunk, rounds, dict(payoff_matrix), seeds.get(name), instruments.enabled)
+                     for name, chunk in chunks]
+            results = []
+            for chunk_scores, counts in self.pool.map(play_chunk, tasks, chunksize=1):
+                results.append(chunk_scores)
+                if counts:
+                    instruments.merge(counts)
+
+        # Put the chunks of every match back together
+        scores = []
+        first = 0
+        for count in chunk_counts:
+            scores.append(numpy.concatenate(results[first:first + count]) if count else numpy.zeros(0))
+            first += count
+        return scores
+
+    def start(self, opponents):
+        if self.pool is not None and opponents == self.pool_opponents:
+            return
+        self.close()
+        if self.executor == "thread":
+            self.pool = multiprocessing.pool.ThreadPool(self.pool_size)
+        else:
+            self.pool = multiprocessing.Pool(self.pool_size, initializer=init_worker,
+                                             initargs=(opponents,))
+        self.pool_opponents = dict(opponents)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        self.pool = None
+        self.pool_opponents = None
+
+
+# Evaluate the performance of the whole population at once. Scores against
+# deterministic opponents are taken from the optional cache when possible,
+# stochastic opponents are always played. The matches are played by the
+# optional evaluator, serially by default, with the optional common random
+# numbers of the stochastic opponents (see common_seeds)
+def evaluate_population(population, opponents, rounds, cache=None, evaluator=None, seeds=None):
+    evaluator = evaluator or PopulationEvaluator()
+    genomes = population_matrix(population)
+    payoffs = tuple(sorted(payoff_matrix.items()))
+    keys = [genome.tobytes() for genome in genomes] if cache is not None else None
+
+    # Look up cached scores and collect the distinct genomes that still
+    # have to play each opponent
+    cached_scores = []
+    matches = []
+    for name, opponent in opponents.items():
+        if cache is not None and getattr(opponent, 'deterministic', False):
+            context = (opponent, rounds, payoffs)
+            scores = [cache.get((key, context)) for key in keys]
+            missing = list(dict.fromkeys(key for key, score in zip(keys, scores) if score is None))
+        else:
+            context = None
+            scores = None
+            missing = genomes
+        cached_scores.append((context, scores))
+        matches.append((name, missing))
+
+    played_scores = evaluator.play(matches, opponents, rounds, seeds)
+
+    totals = numpy.zeros(len(genomes))
+    for (context, scores), (_, missing), played in zip(cached_scores, matches, played_scores):
+        if context is not None:
+            played = dict(zip(missing, played.tolist()))
+            for key, score in played.items():
+                cache.put((key, context), score)
+            played = numpy.array([played[key] if score is None else score
+                                  for key, score in zip(keys, scores)])
+        totals += played / rounds
+    return (totals / len(opponents)).tolist()
+
+
+# Lowest and highest payoff a player can score in a round
+def payoff_bounds(matrix=payoff_matrix):
+    payoffs = [payoff for payoff, _ in matrix.values()]
+    return min(payoffs), max(payoffs)
+
+
+# Strategy calls score_bounds may make before it settles for the bounds of
+# the payoff matrix
+BOUND_SEARCH_CALLS = 100000
+
+
+# Lowest and highest score any player can make against an opponent in a match
+# of the given rounds, under the payoff matrix given as sorted items. Against
+# a deterministic finite-memory opponent every sequence of moves is searched,
+# merging the sequences the opponent cannot tell apart within a match: the
+# same first `warmup` rounds and the same last `memory` moves (the histories
+# in between are filled in). Other opponents get the bounds of the matrix
+@functools.lru_cache(maxsize=1024)
+def score_bounds(opponent, rounds, payoffs):
+    matrix = dict(payoffs)
+    low, high = payoff_bounds(matrix)
+    if not is_finite_memory(opponent) or hasattr(opponent, 'move'):
+        return rounds * low, rounds * high
+
+    # Joint states as (own opening, opponent opening, own last moves,
+    # opponent last moves) with the lowest and highest score reaching them
+    states = {((), (), (), ()): (0, 0)}
+    calls = 0
+    for round_number in range(rounds):
+        calls += len(states)
+        if calls > BOUND_SEARCH_CALLS:
+            return rounds * low, rounds * high
+
+        following = {}
+        for (own_opening, opponent_opening, own_last, opponent_last), (lowest, highest) in states.items():
+            filler = [COOPERATE] * (round_number - len(own_opening) - len(own_last))
+            reply = opponent(list(opponent_opening) + filler + list(opponent_last),
+                             list(own_opening) + filler + list(own_last))
+            for move in (COOPERATE, DEFECT):
+                payoff = matrix[(move, reply)][0]
+                if round_number < opponent.warmup:
+                    state = (own_opening + (move,), opponent_opening + (reply,), (), ())
+                else:
+                    keep = max(0, len(own_last) + 1 - opponent.memory)
+                    state = (own_opening, opponent_opening, (own_last + (move,))[keep:],
+                             (opponent_last + (reply,))[keep:])
+                if state in following:
+                    reached_lowest, reached_highest = following[state]
+                    following[state] = (min(reached_lowest, lowest + payoff), max(reached_highest, highest + payoff))
+                else:
+                    following[state] = (lowest + payoff, highest + payoff)
+        states = following
+
+    return min(lowest for lowest, _ in states.values()), max(highest for _, highest in states.values())
+
+
+# Evaluates the population like evaluate_population, but races it through the
+# opponents one at a time, those with the widest score bounds (see
+# score_bounds) first. An individual stops playing as soon as even its highest
+# possible scores against the remaining opponents cannot lift it into the
+# survivor_count best, which at least the best lowest possible scores reach.
+# The scores of the individuals that finish are summed in the same order as
+# in evaluate_population, so they get exactly the same fitness and selection
+# picks the same survivors. Dropped individuals get a fitness of -inf.
+#
+# Stochastic opponents only play the same matches as in evaluate_population
+# with common random numbers (seeds)
+def race_population(population, opponents, rounds, survivor_count, cache=None, evaluator=None, seeds=None):
+    genomes = population_matrix(population)
+    survivor_count = max(1, min(survivor_count, len(genomes)))
+    names = list(opponents)
+    payoffs = tuple(sorted(payoff_matrix.items()))
+    bounds = numpy.array([score_bounds(opponents[name], rounds, payoffs) for name in names]) / rounds
+    order = numpy.argsort(bounds[:, 0] - bounds[:, 1], kind='stable')
+
+    # Margin for rounding in the sums of the bounds
+    low, high = payoff_bounds()
+    slack = 1e-9 * len(opponents) * (abs(low) + abs(high) + 1)
+
+    scores = numpy.zeros((len(names), len(genomes)))
+    totals = numpy.zeros(len(genomes))
+    active = numpy.arange(len(genomes))
+    for raced, k in enumerate(order):
+        scores[k, active] = evaluate_population(genomes[active], {names[k]: opponents[names[k]]}, rounds, cache,
+                                                evaluator, seeds)
+        if raced == len(order) - 1:
+            break
+        totals[active] += scores[k, active]
+        lowest_to_come, highest_to_come = bounds[order[raced + 1:]].sum(axis=0)
+        lower = totals[active] + lowest_to_come
+        threshold = numpy.partition(lower, len(lower) - survivor_count)[len(lower) - survivor_count]
+        active = active[totals[active] + highest_to_come >= threshold - slack]
+
+    fitnesses = numpy.full(len(genomes), float('-inf'))
+    fitnesses[active] = 0
+    for k in range(len(names)):
+        fitnesses[active] += scores[k, active]
+    fitnesses[active] /= len(opponents)
+    return fitnesses.tolist()
 
 
 # Evaluate the performance of an algorithm
@@ -74,121 +572,148 @@ def evaluate_individual(individual, opponents, rounds):
     num_matches = len(opponents)
 
     for opponent in opponents.values():
-        _, _, score, _ = run_match(individual, opponent, rounds)
+        _, _, score, _ = run_match(individual, opponent, rounds, keep_history=None)
         total += score / rounds
     return total / num_matches
 
 
-# Select survivors based on fitness
+# Select survivors based on fitness. Returns the rows of the population matrix
+# with the highest fitness, keeping the original order among equal fitnesses
 def select_survivors(population, fitnesses, survivor_count):
-    pairs = []
-
-    # Pair each strategy with its fitness
-    for i in range(len(population)):
-        pairs.append((fitnesses[i], population[i]))
-
-    # Sort the list with pairs based on fitness
-    pairs.sort(reverse=True, key=lambda pair: pair[0])
-
-    survivors = []
-    for i in range(survivor_count):
-        survivors.append(pairs[i][1])
-
-    return survivors
+    order = numpy.argsort(-numpy.asarray(fitnesses), kind='stable')
+    return population_matrix(population)[order[:survivor_count]]
 
 
 # Does crossover between two parents and then creates a new child
 def crossover(parent1, parent2):
-    new_opening = []
-    # Create new opening sequence by randomly picking from parents
-    for i in range(3):
-        move = random.choice([parent1['opening'][i], parent2['opening'][i]])
-        new_opening.append(move)
-
-    new_rule_table = {}
-    # Create new rule table by randomly picking rules from parents
-    for move_history in parent1['rule_table']:
-        parent1_move = parent1['rule_table'][move_history]
-        parent2_move = parent2['rule_table'][move_history]
-
-        child_move = random.choice([parent1_move, parent2_move])
-
-        new_rule_table[move_history] = child_move
-
-    return {"opening": new_opening, "rule_table": new_rule_table}
+    # Create new opening and rule table by randomly picking from parents
+    genes = [random.choice((gene1, gene2)) for gene1, gene2 in zip(unpack_genome(parent1), unpack_genome(parent2))]
+    return pack_genome(genes)
 
 
 # Mutates a strategy by the given mutation rate
 def mutate(individual, mutation_rate=0.05):
-    new_opening = []
-    # Mutate opening of rule table
-    for move in individual['opening']:
-        if move == COOPERATE and random.random() < mutation_rate:
-            new_opening.append(DEFECT)
-        elif move == DEFECT and random.random() < mutation_rate:
-            new_opening.append(COOPERATE)
-        else:
-            new_opening.append(move)
-    individual['opening'] = new_opening
+    # Flip every gene of the opening and rule table with the mutation rate
+    genes = [gene ^ 1 if random.random() < mutation_rate else gene
+             for gene in unpack_genome(individual)]
+    return pack_genome(genes)
 
-    # Mutate the rule table
-    for key in individual['rule_table']:
-        if random.random() < mutation_rate:
-            current = individual['rule_table'][key]
-            individual['rule_table'][key] = DEFECT if current == COOPERATE else COOPERATE
 
-    return individual
+# Creates `count` children at once from random pairs of survivors, picking
+# every gene from either parent. Works on the packed bits directly: a random
+# byte mask selects the bits of the first parent
+def crossover_population(survivors, count, rng):
+    parents = rng.integers(0, len(survivors), (2, count))
+    from_first = rng.integers(0, 256, (count, survivors.shape[1]), dtype=numpy.uint8)
+    return (survivors[parents[0]] & from_first) | (survivors[parents[1]] & ~from_first)
 
 
-def genetic_algorithm_step(population, opponents, rounds, mutation_rate, survivor_fraction):
-    # Calculate fitness for each individual
-    fitnesses = [evaluate_individual(ind, opponents, rounds) for ind in population]
+# Mutates all children at once by flipping genes with the mutation rate
+def mutate_population(children, mutation_rate, rng):
+    flips = rng.random((len(children), genome_length(genome_memory(children)))) < mutation_rate
+    return children ^ numpy.packbits(flips, axis=1)
 
-    best_individual = None
-    best_fitness = float('-inf')
 
-    # Determine the best individual
-    for i in range(len(population)):
-        if fitnesses[i] > best_fitness:
-            best_fitness = fitnesses[i]
-            best_individual = population[i]
+# Evaluates the population, selects the survivors and breeds the next
+# generation. With racing, individuals that cannot survive are not evaluated
+# against all opponents, see race_population. With common_random_numbers all
+# individuals meet every stochastic opponent with the same random numbers,
+# drawn anew every generation, see play_population
+def genetic_algorithm_step(population, opponents, rounds, mutation_rate, survivor_fraction, *, cache=None,
+                           evaluator=None, racing=False, common_random_numbers=False):
+    population = population_matrix(population)
 
     # Determine the number of survivors based on the survivor fraction
     survivor_count = int(len(population) * survivor_fraction)
-    survivors = select_survivors(population, fitnesses, survivor_count)
+    seeds = common_seeds(opponents) if common_random_numbers else None
 
-    # Use all survivors as the elite group (directly carried over)
-    new_population = survivors.copy()
+    # Calculate fitness for each individual
+    with instruments.timer("evaluation_seconds"):
+        if racing:
+            fitnesses = race_population(population, opponents, rounds, survivor_count, cache, evaluator, seeds)
+        else:
+            fitnesses = evaluate_population(population, opponents, rounds, cache, evaluator, seeds)
 
-    # Fill the remainder of the population with offspring from survivors
-    while len(new_population) < len(population):
-        parent1 = random.choice(survivors)
-        parent2 = random.choice(survivors)
-        child = crossover(parent1, parent2)
-        child = mutate(child, mutation_rate)
-        new_population.append(child)
+    # Determine the best individual
+    best = int(numpy.argmax(fitnesses))
+    best_individual = population[best].tobytes()
+    best_fitness = fitnesses[best]
 
-    return new_population, best_individual, best_fitness
+    with instruments.timer("selection_seconds"):
+        survivors = select_survivors(population, fitnesses, survivor_count)
 
+    # Use all survivors as the elite group (directly carried over) and fill
+    # the remainder of the population with offspring from survivors
+    with instruments.timer("variation_seconds"):
+        rng = population_rng()
+        children = crossover_population(survivors, len(population) - survivor_count, rng)
+        children = mutate_population(children, mutation_rate, rng)
+        new_population = numpy.concatenate((survivors, children))
 
-# Runs the full genetic
-def genetic_algorithm(opponents, population_size, num_generations, rounds, mutation_rate, survivor_fraction, elite_count):
-    # Make a population of random strategies
-    population = [random_individual() for _ in range(population_size)]
+    return new_population, best_individual, best_fitness
 
-    best_individual = None
-    best_fitness = float('-inf')
 
-    # Run the genetic algorithm for 'num_generations' generations
-    for generation in range(num_generations):
-        population, current_best_individual, current_best_fitness = genetic_algorithm_step(
-            population, opponents, rounds, mutation_rate, survivor_fraction, elite_count)
+# A genetic algorithm run that is advanced one generation at a time, so
+# callers can report, pause or stop between generations. Iterating over it
+# yields (generation, best individual, best fitness) of every generation
+class GeneticRun:
+    def __init__(self, opponents, population_size, rounds, mutation_rate, survivor_fraction, memory=MEMORY,
+                 cache=None, evaluator=None, racing=False, common_random_numbers=False):
+        self.opponents = opponents
+        self.rounds = rounds
+        self.mutation_rate = mutation_rate
+        self.survivor_fraction = survivor_fraction
+        self.racing = racing
+        self.common_random_numbers = common_random_numbers
+        self.population = random_population(population_size, memory)
+        self.cache = cache if cache is not None else ScoreCache()
+        self.evaluator = evaluator if evaluator is not None else PopulationEvaluator()
+        self.generation = 0
+
+        # Best individual over all generations
+        self.best_individual = None
+        self.best_fitness = float('-inf')
+
+    # Evaluates the current generation and breeds the next one
+    def step(self):
+        self.population, best_individual, best_fitness = genetic_algorithm_step(
+            self.population, self.opponents, self.rounds, self.mutation_rate, self.survivor_fraction,
+            cache=self.cache, evaluator=self.evaluator, racing=self.racing,
+            common_random_numbers=self.common_random_numbers)
 
         # Update best fitness if the best fitness of the latest generation
         # is greater than previous best fitnesses
-        if current_best_fitness > best_fitness:
-            best_fitness = current_best_fitness
-            best_individual = current_best_individual
+        if best_fitness > self.best_fitness:
+            self.best_fitness = best_fitness
+            self.best_individual = best_individual
+
+        generation = self.generation
+        self.generation += 1
+        return generation, best_individual, best_fitness
+
+    def __iter__(self):
+        while True:
+            yield self.step()
 
-        print(f"Generation {generation}: Best Fitness = {current_best_fitness}")
-    return best_individual, best_fitness
+
+# Runs the full genetic algorithm and returns the best individual over all
+# generations. elite_count is no longer used, all survivors are the elite
+def genetic_algorithm(opponents, population_size, num_generations, rounds, mutation_rate, survivor_fraction,
+                      elite_count=None, executor="serial", workers=0, memory=MEMORY, progress=None, racing=False,
+                      common_random_numbers=False):
+    evaluator = PopulationEvaluator(executor, workers)
+    run = GeneticRun(opponents, population_size, rounds, mutation_rate, survivor_fraction, memory,
+                     evaluator=evaluator, racing=racing, common_random_numbers=common_random_numbers)
+
+    # Run the genetic algorithm for 'num_generations' generations
+    try:
+        for generation, _, best_fitness in itertools.islice(run, num_generations):
+            # Report the generation, the progress callback can stop the run
+            # early by returning True
+            if progress is None:
+                print(f"Generation {generation}: Best Fitness = {best_fitness}")
+            elif progress(generation, best_fitness):
+                break
+    finally:
+        evaluator.close()
+    return run.best_individual, run.best_fitness
@@ -0,0 +1,130 @@
+"""
+Naam: Simon Plas, Boris Vukaljovic
+UvAID: 15249514, 15225054
+Description:
+Implements counters and timers for the hot paths of the simulation: matches
+played, rounds simulated, strategy calls and the time spent per phase of a
+generation. They are collected per generation and can be written to a CSV or
+JSON lines file. While disabled, every instrumented place costs one check.
+"""
+import contextlib
+import csv
+import json
+import threading
+import time
+
+# Counters and timers in the order they are written
+COUNTERS = ("matches_played", "rounds_simulated", "strategy_calls")
+TIMERS = ("evaluation_seconds", "selection_seconds", "variation_seconds", "tournament_seconds", "drawing_seconds")
+FIELDS = ("generation",) + COUNTERS + TIMERS
+
+# Used instead of a timer while disabled
+NO_TIMER = contextlib.nullcontext()
+
+
+# Adds the time spent in a with block to a timer
+class Timer:
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exception):
+        self.instruments.count(self.name, time.perf_counter() - self.start)
+
+
+# Counters and timers of the current generation, the records of the finished
+# generations and the totals over all of them. Counting is thread safe, so
+# thread pool workers can count too
+class Instruments:
+    def __init__(self):
+        self.enabled = False
+        self.current = {}
+        self.totals = {}
+        self.generations = []
+        self.path = None
+        self.lock = threading.Lock()
+
+    # Clears everything, and starts a new file for the generations when a
+    # path is given
+    def reset(self, enabled=False, path=None):
+        self.enabled = enabled
+        self.current = {}
+        self.totals = {}
+        self.generations = []
+        self.path = path or None
+        if self.path is not None:
+            open(self.path, "w").close()
+
+    # Adds to a counter or timer. Callers check enabled first
+    def count(self, name, amount=1):
+        with self.lock:
+            self.current[name] = self.current.get(name, 0) + amount
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NO_TIMER
+
+    # Returns the counts of the current generation and clears them
+    def take(self):
+        with self.lock:
+            counts, self.current = self.current, {}
+        return counts
+
+    # Adds counts taken in another process
+    def merge(self, counts):
+        for name, amount in counts.items():
+            self.count(name, amount)
+
+    # Closes the record of a generation and appends it to the file
+    def end_generation(self, generation):
+        counts = self.take()
+        record = {name: counts.get(name, 0) for name in FIELDS}
+        record["generation"] = generation
+        self.generations.append(record)
+        for name, amount in counts.items():
+            self.totals[name] = self.totals.get(name, 0) + amount
+        if self.path is not None:
+            append_records(self.path, [record], header=len(self.generations) == 1)
+
+    # The totals including the generation in progress
+    def snapshot(self):
+        with self.lock:
+            current = dict(self.current)
+        return {name: self.totals.get(name, 0) + current.get(name, 0) for name in COUNTERS + TIMERS}
+
+    # Writes the records of all finished generations to a file
+    def export(self, path):
+        open(path, "w").close()
+        append_records(path, self.generations, header=True)
+
+
+# Appends records to a CSV file, or to a JSON lines file when the path ends
+# with .jsonl
+def append_records(path, records, header):
+    with open(path, "a", newline="") as f:
+        if path.endswith(".jsonl"):
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            return
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        if header:
+            writer.writeheader()
+        writer.writerows(records)
+
+
+# Runs a function in a process pool worker and returns its result with the
+# counts it made, so the parent can merge them. Forked workers inherit the
+# counts of the parent, those are dropped first
+def counted(instrumented, function, *args):
+    if not instrumented:
+        return function(*args), None
+    instruments.enabled = True
+    instruments.take()
+    result = function(*args)
+    return result, instruments.take()
+
+
+# The instruments of this process
+instruments = Instruments()
@@ -5,51 +5,688 @@ Description:
 Implements match and tournament functions for the Iterated Prisoner's Dilemma,
 allowing strategies to compete in regular matches and tournaments.
 """
-from ipd_simulation.strategies import payoff_matrix
+import copy
+import math
+import multiprocessing
+import multiprocessing.pool
+import os
+import random
+import time
+import numpy
+from ipd_simulation.strategies import COOPERATE, DEFECT, incremental_strategies, payoff_matrix
+from ipd_simulation.instrumentation import counted, instruments
 
 
-# Fuction to run a match between two strategies
-def run_match(strategy_A, strategy_B, rounds, payoff_matrix=payoff_matrix):
+# Outcomes of a round as (move A, move B), in the order used for outcome counts
+OUTCOMES = [(COOPERATE, COOPERATE), (COOPERATE, DEFECT), (DEFECT, COOPERATE), (DEFECT, DEFECT)]
+
+
+# Whether the match engine may extrapolate matches of a strategy, see
+# strategies.finite_memory
+def is_finite_memory(strategy):
+    return getattr(strategy, 'deterministic', False) and hasattr(strategy, 'memory')
+
+
+# Returns an incremental player (an object with reset() and move(last_own,
+# last_opponent)) for the strategy, or None if the strategy is a function of
+# both histories without an incremental equivalent
+def incremental_player(strategy):
+    if hasattr(strategy, 'move'):
+        return strategy
+    if strategy in incremental_strategies:
+        return incremental_strategies[strategy]()
+    return None
+
+
+# Number of trailing moves a strategy reads from the histories, or None if it
+# may read the full histories
+def history_depth(strategy):
+    if incremental_player(strategy) is not None:
+        return 0
+    return getattr(strategy, 'history_depth', None)
+
+
+# Raised by a timed strategy that failed to make a move, from the error it
+# raised. side is 0 for strategy A and 1 for strategy B
+class StrategyFailed(Exception):
+    def __init__(self, side):
+        super().__init__(side)
+        self.side = side
+
+
+# Raised by a timed strategy when a single move takes longer than the move
+# budget
+class MoveBudgetExceeded(StrategyFailed):
+    pass
+
+
+# Calls a strategy function, or the move of an incremental player, and adds
+# the time spent in it to timings[side]. Errors of the strategy are raised as
+# StrategyFailed, so callers know which side caused them
+class TimedCall:
+    def __init__(self, function, timings, side, budget=None):
+        self.function = function
+        self.timings = timings
+        self.side = side
+        self.budget = budget
+
+    def __call__(self, *args):
+        start = time.perf_counter()
+        try:
+            move = self.function(*args)
+        except Exception as error:
+            raise StrategyFailed(self.side) from error
+        elapsed = time.perf_counter() - start
+        self.timings[self.side] += elapsed
+        if self.budget is not None and elapsed > self.budget:
+            raise MoveBudgetExceeded(self.side)
+        return move
+
+
+# Converts a bit-packed history returned by run_match back to a list of moves
+def unpack_history(packed, rounds):
+    bits = numpy.unpackbits(packed)[:rounds]
+    return [DEFECT if bit else COOPERATE for bit in bits.tolist()]
+
+
+# Fuction to run a match between two strategies. Strategies are either
+# functions of both histories or incremental players.
+#
+# With keep_history "list" the full histories are returned as lists of moves,
+# with "packed" as bit-packed NumPy arrays (1 for DEFECT, see unpack_history)
+# and with None no histories are returned. In the last two modes only as much
+# history as the strategies declare to need is kept in memory.
+#
+# With return_outcomes the number of rounds that ended in each of OUTCOMES is
+# returned as a fifth value.
+#
+# With timings, a list of two floats, the seconds spent inside both strategies
+# are added to it. A move of a timed strategy that takes longer than
+# move_budget seconds raises MoveBudgetExceeded, a move that fails raises
+# StrategyFailed. move_budget may also be a pair of budgets for A and B, where
+# None leaves that side without a budget.
+def run_match(strategy_A, strategy_B, rounds, payoff_matrix=payoff_matrix, keep_history="list",
+              return_outcomes=False, timings=None, move_budget=None):
     history_A = []
     history_B = []
     score_A = 0
     score_B = 0
+    outcomes = dict.fromkeys(OUTCOMES, 0) if return_outcomes else None
+
+    player_A = incremental_player(strategy_A)
+    player_B = incremental_player(strategy_B)
+    if player_B is not None and player_B is player_A:
+        player_B = copy.deepcopy(player_A)
+    for player in (player_A, player_B):
+        if player is not None:
+            player.reset()
+    move_A = None
+    move_B = None
+
+    # Between two deterministic finite-memory strategies the joint state of
+    # the match eventually repeats, after which the remaining rounds are
+    # repetitions of the same cycle
+    detect_cycles = is_finite_memory(strategy_A) and is_finite_memory(strategy_B)
+    memory = 0
+    if detect_cycles:
+        memory = max(strategy_A.memory, strategy_B.memory)
+        warmup = max(strategy_A.warmup, strategy_B.warmup)
+        period = math.lcm(strategy_A.period, strategy_B.period)
+        seen_states = {}
+
+    # Keep only a window of the histories if they are not returned in full and
+    # both strategies declare how much of them they read
+    depths = (history_depth(strategy_A), history_depth(strategy_B))
+    window = None
+    if keep_history != "list" and None not in depths:
+        window = max(depths + (memory,))
+    if keep_history == "packed":
+        moves_A = bytearray()
+        moves_B = bytearray()
+
+    # Timing wraps the calls, so untimed matches do not pay for it
+    play_A = player_A.move if player_A is not None else None
+    play_B = player_B.move if player_B is not None else None
+    if timings is not None:
+        budget_A, budget_B = move_budget if isinstance(move_budget, tuple) else (move_budget, move_budget)
+        if player_A is None:
+            strategy_A = TimedCall(strategy_A, timings, 0, budget_A)
+        else:
+            play_A = TimedCall(play_A, timings, 0, budget_A)
+        if player_B is None:
+            strategy_B = TimedCall(strategy_B, timings, 1, budget_B)
+        else:
+            play_B = TimedCall(play_B, timings, 1, budget_B)
 
     # Play the match for the given number of rounds
-    for _ in range(rounds):
-        move_A = strategy_A(history_A, history_B)
-        move_B = strategy_B(history_B, history_A)
+    round_number = 0
+    skipped_rounds = 0
+    while round_number < rounds:
+        if detect_cycles and round_number >= warmup:
+            state = (tuple(history_A[len(history_A) - memory:]),
+                     tuple(history_B[len(history_B) - memory:]),
+                     round_number % period)
+
+            if state in seen_states:
+                # Skip all complete repetitions of the cycle at once
+                cycle_start, cycle_score_A, cycle_score_B, cycle_outcomes = seen_states[state]
+                cycle_length = round_number - cycle_start
+                cycles = (rounds - round_number) // cycle_length
+
+                score_A += cycles * (score_A - cycle_score_A)
+                score_B += cycles * (score_B - cycle_score_B)
+                if outcomes is not None:
+                    for outcome, count in cycle_outcomes.items():
+                        outcomes[outcome] += cycles * (outcomes[outcome] - count)
+                if window is None:
+                    history_A.extend(history_A[cycle_start:round_number] * cycles)
+                    history_B.extend(history_B[cycle_start:round_number] * cycles)
+                if keep_history == "packed":
+                    moves_A.extend(moves_A[cycle_start:round_number] * cycles)
+                    moves_B.extend(moves_B[cycle_start:round_number] * cycles)
+                round_number += cycles * cycle_length
+                skipped_rounds = cycles * cycle_length
+
+                # Play the remaining part of the cycle normally
+                detect_cycles = False
+                continue
+            seen_states[state] = (round_number, score_A, score_B,
+                                  outcomes.copy() if outcomes is not None else None)
+
+        if player_A is None:
+            next_A = strategy_A(history_A, history_B)
+        else:
+            next_A = play_A(move_A, move_B)
+        if player_B is None:
+            next_B = strategy_B(history_B, history_A)
+        else:
+            next_B = play_B(move_B, move_A)
+        move_A, move_B = next_A, next_B
 
         payoff_A, payoff_B = payoff_matrix[(move_A, move_B)]
         score_A += payoff_A
         score_B += payoff_B
+        if outcomes is not None:
+            outcomes[(move_A, move_B)] += 1
 
         history_A.append(move_A)
         history_B.append(move_B)
+        if keep_history == "packed":
+            moves_A.append(move_A == DEFECT)
+            moves_B.append(move_B == DEFECT)
+
+        # Drop moves outside of the window now and then, so trimming stays
+        # cheap per round
+        if window is not None and len(history_A) > 2 * window + 64:
+            del history_A[:len(history_A) - window]
+            del history_B[:len(history_B) - window]
+        round_number += 1
 
+    if instruments.enabled:
+        instruments.count("matches_played")
+        instruments.count("rounds_simulated", rounds)
+        instruments.count("strategy_calls", 2 * (rounds - skipped_rounds))
+
+    if keep_history == "packed":
+        history_A = numpy.packbits(numpy.frombuffer(moves_A, dtype=numpy.uint8))
+        history_B = numpy.packbits(numpy.frombuffer(moves_B, dtype=numpy.uint8))
+    elif keep_history is None:
+        history_A = None
+        history_B = None
+    if return_outcomes:
+        return history_A, history_B, score_A, score_B, tuple(outcomes[outcome] for outcome in OUTCOMES)
     return history_A, history_B, score_A, score_B
 
 
-# Runs the tournament between the given strategies
-def run_tournament(strategies, rounds_per_match):
-    results = {}
+# Whether a strategy exposes its cooperation probabilities, see
+# strategies.markov
+def is_markov(strategy):
+    return hasattr(strategy, 'markov_memory') and hasattr(strategy, 'cooperation_probability')
 
-    for name in strategies:
-        results[name] = 0
 
+# Builds the Markov chain of a match between two strategies that expose their
+# cooperation probabilities. A state holds the last moves of both players, up
+# to the largest memory of the two. Returns the transition matrix and, per
+# state, the expected payoffs of both players in the round played from it.
+# The first state is the start of the match.
+def markov_chain(strategy_A, strategy_B, payoff_matrix=payoff_matrix):
+    memory_A = strategy_A.markov_memory
+    memory_B = strategy_B.markov_memory
+    memory = max(memory_A, memory_B)
+
+    states = [((), ())]
+    index = {states[0]: 0}
+    transitions = []
+    payoffs = []
+
+    # Explore all reachable states breadth first
+    for history_A, history_B in states:
+        rounds = len(history_A)
+        p_A = strategy_A.cooperation_probability(history_A[max(0, rounds - memory_A):],
+                                                 history_B[max(0, rounds - memory_A):])
+        p_B = strategy_B.cooperation_probability(history_B[max(0, rounds - memory_B):],
+                                                 history_A[max(0, rounds - memory_B):])
+
+        row = {}
+        payoff = [0.0, 0.0]
+        for move_A, chance_A in ((COOPERATE, p_A), (DEFECT, 1 - p_A)):
+            for move_B, chance_B in ((COOPERATE, p_B), (DEFECT, 1 - p_B)):
+                chance = chance_A * chance_B
+                if chance == 0:
+                    continue
+                payoff_A, payoff_B = payoff_matrix[(move_A, move_B)]
+                payoff[0] += chance * payoff_A
+                payoff[1] += chance * payoff_B
+
+                following = ((history_A + (move_A,))[max(0, rounds + 1 - memory):],
+                             (history_B + (move_B,))[max(0, rounds + 1 - memory):])
+                if following not in index:
+                    index[following] = len(states)
+                    states.append(following)
+                row[index[following]] = row.get(index[following], 0) + chance
+        transitions.append(row)
+        payoffs.append(payoff)
+
+    matrix = numpy.zeros((len(states), len(states)))
+    for state, row in enumerate(transitions):
+        for following, chance in row.items():
+            matrix[state, following] = chance
+    return matrix, numpy.array(payoffs)
+
+
+# Computes the exact expected scores of a match between two strategies that
+# expose their cooperation probabilities, instead of simulating it. The match
+# lasts `rounds` rounds, or with a continuation probability every round is
+# followed by another one with that probability.
+def expected_match(strategy_A, strategy_B, rounds=None, payoff_matrix=payoff_matrix, continuation=None):
+    for strategy in (strategy_A, strategy_B):
+        if not is_markov(strategy):
+            raise ValueError("Strategy " + str(strategy) + " does not expose its cooperation probabilities")
+    matrix, payoffs = markov_chain(strategy_A, strategy_B, payoff_matrix)
+
+    if continuation is not None:
+        # Round t is played with probability continuation ** t
+        visits = numpy.linalg.solve((numpy.eye(len(matrix)) - continuation * matrix).T,
+                                    numpy.eye(len(matrix))[0])
+        expected_A, expected_B = visits @ payoffs
+        return float(expected_A), float(expected_B)
+    if rounds is None:
+        raise ValueError("Either the number of rounds or a continuation probability is required")
+
+    # Sum of the first `rounds` powers of the transition matrix by repeated
+    # doubling, using S(n + m) = S(n) + M^n S(m)
+    total = numpy.zeros_like(matrix)
+    power = numpy.eye(len(matrix))
+    step_total = numpy.eye(len(matrix))
+    step_power = matrix
+    remaining = rounds
+    while remaining:
+        if remaining & 1:
+            total = total + power @ step_total
+            power = power @ step_power
+        step_total = step_total + step_power @ step_total
+        step_power = step_power @ step_power
+        remaining >>= 1
+
+    expected_A, expected_B = total[0] @ payoffs
+    return float(expected_A), float(expected_B)
+
+
+# Runs `size` matches between two vectorized strategies in lock-step, one round
+# at a time for all matches at once. Returns the arrays of scores of both sides
+def run_batch_match(batch_A, batch_B, size, rounds, payoff_matrix=payoff_matrix):
+    # Payoffs indexed by (move A, move B) with 0 for COOPERATE and 1 for DEFECT
+    moves = (COOPERATE, DEFECT)
+    payoffs_A = numpy.array([[payoff_matrix[(a, b)][0] for b in moves] for a in moves])
+    payoffs_B = numpy.array([[payoff_matrix[(a, b)][1] for b in moves] for a in moves])
+
+    batch_A.reset(size)
+    batch_B.reset(size)
+    move_A = None
+    move_B = None
+    scores_A = numpy.zeros(size, dtype=payoffs_A.dtype)
+    scores_B = numpy.zeros(size, dtype=payoffs_B.dtype)
+
+    for _ in range(rounds):
+        move_A, move_B = batch_A.move(move_A, move_B), batch_B.move(move_B, move_A)
+
+        scores_A += payoffs_A[move_A, move_B]
+        scores_B += payoffs_B[move_A, move_B]
+
+    # Every call of a batch strategy moves the whole batch
+    if instruments.enabled:
+        instruments.count("matches_played", size)
+        instruments.count("rounds_simulated", size * rounds)
+        instruments.count("strategy_calls", 2 * rounds)
+
+    return scores_A, scores_B
+
+
+# Plays a tournament match and returns the scores, the outcome counts and the
+# seconds spent in both strategies, which are None when not timed
+def play_tournament_match(strategy_A, strategy_B, rounds, timing=False, move_budget=None):
+    timings = [0.0, 0.0] if timing else None
+    played = run_match(strategy_A, strategy_B, rounds, keep_history=None, return_outcomes=True,
+                       timings=timings, move_budget=move_budget)
+    return played[2:] + (timings,)
+
+
+# Plays one shard of tournament pairs in a process pool worker
+def play_pairs(task):
+    strategies, pairs, rounds, matrix, timing, instrumented = task
+    if matrix != payoff_matrix:
+        payoff_matrix.clear()
+        payoff_matrix.update(matrix)
+    return counted(instrumented, lambda: [play_tournament_match(strategies[name_A], strategies[name_B], rounds, timing)
+                                          for name_A, name_B in pairs])
+
+
+# Gives every process pool worker its own random stream
+def seed_worker():
+    random.seed()
+
+
+# Scores of a forfeited match. The strategy that ran over its budget (side 0
+# or 1, or None for both) scores nothing, its opponent scores mutual
+# cooperation for every round
+def forfeit_scores(rounds, side, matrix=payoff_matrix):
+    reward = matrix[(COOPERATE, COOPERATE)]
+    return (0 if side in (0, None) else rounds * reward[0],
+            0 if side in (1, None) else rounds * reward[1])
+
+
+# Plays matches sent over a pipe until the pipe is closed. Runs in the process
+# of a Sandbox. move_budget holds the budgets of both sides, see run_match
+def sandbox_worker(connection, strategies):
+    random.seed()
+    while True:
+        try:
+            name_A, name_B, rounds, matrix, move_budget, instrumented = connection.recv()
+        except EOFError:
+            return
+        if matrix != payoff_matrix:
+            payoff_matrix.clear()
+            payoff_matrix.update(matrix)
+        timings = [0.0, 0.0]
+        try:
+            played, counts = counted(instrumented, lambda: run_match(
+                strategies[name_A], strategies[name_B], rounds, keep_history=None, return_outcomes=True,
+                timings=timings, move_budget=move_budget))
+            connection.send((played[2:], None, timings, counts))
+        except StrategyFailed as failed:
+            connection.send((None, failed.side, timings, instruments.take() if instrumented else None))
+
+
+# A process that plays the matches of untrusted strategies, so a match that
+# runs over its budget can be killed and a strategy that crashes the process
+# does not take the tournament with it. A killed process is replaced by a new
+# one for the next match
+class Sandbox:
+    def __init__(self, strategies):
+        self.strategies = strategies
+        self.process = None
+        self.connection = None
+
+    def start(self):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=sandbox_worker, args=(child, self.strategies), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+            self.process = None
+
+    # Plays a match under the payoff matrix and returns (scores and outcome
+    # counts, forfeiting side, timings, counts). Scores are None for a forfeit,
+    # and the whole result is None when the match did not finish within
+    # timeout seconds or the process died
+    def play(self, name_A, name_B, rounds, matrix, move_budget, timeout, instrumented):
+        if self.process is None:
+            self.start()
+        try:
+            self.connection.send((name_A, name_B, rounds, matrix, move_budget, instrumented))
+            if self.connection.poll(timeout):
+                return self.connection.recv()
+        except (EOFError, OSError):
+            pass
+        self.stop()
+        return None
+
+
+# Plays one shard of tournament pairs in a sandbox, in a thread pool worker.
+# Only untrusted strategies get the move budget, and matches that run over a
+# budget are forfeited by the untrusted side
+def play_sandboxed(task):
+    strategies, pairs, rounds, matrix, move_budget, match_budget, untrusted, instrumented = task
+
+    # Without a match budget a match may take every move up to its budget
+    timeout = match_budget
+    if timeout is None:
+        timeout = 2 * rounds * move_budget + 1
+
+    sandbox = Sandbox(strategies)
+    played = []
+    try:
+        for name_A, name_B in pairs:
+            budgets = tuple(move_budget if name in untrusted else None for name in (name_A, name_B))
+            result = sandbox.play(name_A, name_B, rounds, matrix, budgets, timeout, instrumented)
+            if result is None:
+                # Killed or died, blame the untrusted side if only one is
+                sides = [side for side, name in enumerate((name_A, name_B)) if name in untrusted]
+                played.append((None, sides[0] if len(sides) == 1 else None, None))
+                continue
+            match, side, timings, counts = result
+            if counts:
+                instruments.merge(counts)
+            played.append((match, side, timings))
+    finally:
+        sandbox.stop()
+    return played
+
+
+# Plays the pairs in sandboxes, see play_sandboxed, sharded over a number of
+# sandboxes (0 uses one per core). Returns (scores and outcome counts,
+# forfeiting side, timings) per pair, in pair order
+def play_pairs_sandboxed(strategies, pairs, rounds, matrix, move_budget, match_budget, untrusted, workers):
+    # Every sandbox is a process of its own, so the threads driving them
+    # only wait
+    shard_count = min(workers or os.cpu_count(), len(pairs))
+    tasks = [(strategies, pairs[shard::shard_count], rounds, matrix, move_budget, match_budget, untrusted,
+              instruments.enabled)
+             for shard in range(shard_count)]
+    with multiprocessing.pool.ThreadPool(shard_count) as pool:
+        shard_played = pool.map(play_sandboxed, tasks, chunksize=1)
+
+    played = [None] * len(pairs)
+    for shard, matches in enumerate(shard_played):
+        played[shard::shard_count] = matches
+    return played
+
+
+# Plays every unique pair of strategies and returns a record of the tournament
+# holding the scores and outcome counts of every match, see run_tournament and
+# rescore_tournament.
+#
+# With timing the seconds spent inside every strategy are recorded, see
+# slowest_strategies. With a move_budget or match_budget (seconds) the matches
+# of untrusted strategies (all strategies if None) are played in sandbox
+# processes that are killed when a match runs over its budget. A strategy
+# that runs over its budget, raises an error or kills its sandbox forfeits
+# the match, see forfeit_scores.
+def record_tournament(strategies, rounds_per_match, workers=1, timing=False, move_budget=None, match_budget=None,
+                      untrusted=None):
     strategy_names = list(strategies.keys())
 
-    # Iterate through all unique pairs of strategies. Let every strategy
-    # play against every other strategy
+    # All unique pairs of strategies. Let every strategy play against every
+    # other strategy
+    pairs = []
     for i in range(len(strategy_names)):
         for j in range(i + 1, len(strategy_names)):
-            name_A = strategy_names[i]
-            name_B = strategy_names[j]
+            pairs.append((i, j))
+    named_pairs = [(strategy_names[i], strategy_names[j]) for i, j in pairs]
 
-            strat_A = strategies[name_A]
-            strat_B = strategies[name_B]
+    sandboxed = []
+    if move_budget is not None or match_budget is not None:
+        untrusted = set(strategy_names if untrusted is None else untrusted)
+        sandboxed = [k for k, (name_A, name_B) in enumerate(named_pairs)
+                     if name_A in untrusted or name_B in untrusted]
+    trusted = sorted(set(range(len(pairs))) - set(sandboxed))
+    played = [None] * len(pairs)
 
-            _, _, score_A, score_B = run_match(strat_A, strat_B, rounds_per_match)
-            results[name_A] += score_A
-            results[name_B] += score_B
+    if workers == 1 or len(trusted) < 2:
+        for k in trusted:
+            name_A, name_B = named_pairs[k]
+            played[k] = play_tournament_match(strategies[name_A], strategies[name_B], rounds_per_match, timing)
+    else:
+        # Every n-th pair goes to the same shard, so every shard gets about
+        # the same mix of strategies
+        shard_count = min(workers or os.cpu_count(), len(trusted))
+        tasks = [(strategies, [named_pairs[k] for k in trusted[shard::shard_count]], rounds_per_match,
+                  dict(payoff_matrix), timing, instruments.enabled)
+                 for shard in range(shard_count)]
+        with multiprocessing.Pool(shard_count, initializer=seed_worker) as pool:
+            shard_played = pool.map(play_pairs, tasks, chunksize=1)
+
+        # Put the matches back in pair order
+        for shard, (matches, counts) in enumerate(shard_played):
+            for k, match in zip(trusted[shard::shard_count], matches):
+                played[k] = match
+            if counts:
+                instruments.merge(counts)
+
+    forfeits = {}
+    if sandboxed:
+        matches = play_pairs_sandboxed(strategies, [named_pairs[k] for k in sandboxed], rounds_per_match,
+                                       dict(payoff_matrix), move_budget, match_budget, untrusted, workers)
+        for k, (match, side, timings) in zip(sandboxed, matches):
+            if match is None:
+                forfeits[k] = side
+                match = forfeit_scores(rounds_per_match, side) + ((0, 0, 0, 0),)
+            played[k] = match + (timings,)
+
+    # Seconds per strategy, in pair order so they do not depend on the sharding
+    strategy_seconds = None
+    if timing or sandboxed:
+        strategy_seconds = dict.fromkeys(strategy_names, 0.0)
+        for (name_A, name_B), (_, _, _, timings) in zip(named_pairs, played):
+            if timings is not None:
+                strategy_seconds[name_A] += timings[0]
+                strategy_seconds[name_B] += timings[1]
+
+    return {
+        "strategies": strategies,
+        "names": strategy_names,
+        "rounds": rounds_per_match,
+        "pairs": pairs,
+        "scores": [(score_A, score_B) for score_A, score_B, _, _ in played],
+        "outcomes": numpy.array([outcomes for _, _, outcomes, _ in played], dtype=numpy.int64).reshape(-1, 4),
+        "forfeits": forfeits,
+        "strategy_seconds": strategy_seconds,
+        "untrusted": untrusted if sandboxed else None,
+        "move_budget": move_budget,
+        "match_budget": match_budget,
+    }
+
+
+# The strategies that spent the most time in their moves in a tournament
+# recorded with timing or budgets, as (name, seconds), slowest first
+def slowest_strategies(record, count=10):
+    if record["strategy_seconds"] is None:
+        raise ValueError("The tournament was recorded without timing")
+    return sorted(record["strategy_seconds"].items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+# Sums the scores of a tournament record per strategy in pair order, so the
+# totals do not depend on the sharding
+def tournament_results(record, scores, return_matrix=False):
+    names = record["names"]
+    results = {}
+
+    for name in names:
+        results[name] = 0
+
+    matrix = numpy.zeros((len(names), len(names)))
+    for (i, j), (score_A, score_B) in zip(record["pairs"], scores):
+        results[names[i]] += score_A
+        results[names[j]] += score_B
+        matrix[i, j] = score_A
+        matrix[j, i] = score_B
+
+    if return_matrix:
+        return results, matrix
     return results
+
+
+# Runs the tournament between the given strategies, which can be functions of
+# both histories or incremental players.
+#
+# With workers other than 1 the pairs are split into balanced shards over a
+# pool of processes (0 uses all cores). With return_matrix the N x N array of
+# pairwise scores (row strategy against column strategy, in the order of
+# `strategies`) is returned as well. The budgets are those of
+# record_tournament.
+def run_tournament(strategies, rounds_per_match, workers=1, return_matrix=False, move_budget=None,
+                   match_budget=None, untrusted=None):
+    record = record_tournament(strategies, rounds_per_match, workers, move_budget=move_budget,
+                               match_budget=match_budget, untrusted=untrusted)
+    return tournament_results(record, record["scores"], return_matrix)
+
+
+# Whether the behaviour of a strategy depends on the payoff matrix, see
+# strategies.payoff_dependent
+def is_payoff_dependent(strategy):
+    return getattr(strategy, 'payoff_dependent', False)
+
+
+# Rescores a tournament record under another payoff matrix without replaying
+# it: the score of a match is its outcome counts times the payoffs. Matches
+# involving payoff-dependent strategies are replayed under the new matrix,
+# forfeited matches stay forfeited. Replays of matches that were played in a
+# sandbox are played in sandboxes again, with the budgets of the record and
+# sharded over workers as in record_tournament; they may be forfeited too.
+def rescore_tournament(record, matrix, return_matrix=False, workers=1):
+    payoffs = numpy.array([matrix[outcome] for outcome in OUTCOMES])
+    prices = record["outcomes"] @ payoffs
+    scores = [(score_A, score_B) for score_A, score_B in prices.tolist()]
+
+    strategies = record["strategies"]
+    names = record["names"]
+    forfeits = record.get("forfeits", {})
+    for k, side in forfeits.items():
+        scores[k] = forfeit_scores(record["rounds"], side, matrix)
+
+    replays = [k for k, (i, j) in enumerate(record["pairs"])
+               if k not in forfeits and (is_payoff_dependent(strategies[names[i]])
+                                         or is_payoff_dependent(strategies[names[j]]))]
+
+    untrusted = record.get("untrusted")
+    if untrusted is not None:
+        sandboxed = [k for k in replays
+                     if names[record["pairs"][k][0]] in untrusted or names[record["pairs"][k][1]] in untrusted]
+        replays = [k for k in replays if k not in sandboxed]
+        if sandboxed:
+            named_pairs = [(names[record["pairs"][k][0]], names[record["pairs"][k][1]]) for k in sandboxed]
+            matches = play_pairs_sandboxed(strategies, named_pairs, record["rounds"], dict(matrix),
+                                           record["move_budget"], record["match_budget"], untrusted, workers)
+            for k, (match, side, _) in zip(sandboxed, matches):
+                scores[k] = forfeit_scores(record["rounds"], side, matrix) if match is None else match[:2]
+
+    if replays:
+        # Payoff-dependent strategies read the global payoff matrix
+        original = dict(payoff_matrix)
+        payoff_matrix.clear()
+        payoff_matrix.update(matrix)
+        try:
+            for k in replays:
+                i, j = record["pairs"][k]
+                scores[k] = run_match(strategies[names[i]], strategies[names[j]], record["rounds"],
+                                      keep_history=None)[2:]
+        finally:
+            payoff_matrix.clear()
+            payoff_matrix.update(original)
+
+    return tournament_results(record, scores, return_matrix)
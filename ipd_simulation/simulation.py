@@ -0,0 +1,669 @@
+"""
+Naam: Simon Plas, Boris Vukaljovic
+UvAID: 15249514, 15225054
+Description:
+Implements the Iterated Prisoner's Dilemma simulation model. This module does
+not depend on the GUI, so it can be used by experiments and worker processes
+on machines without a display. Matplotlib is only imported when drawing.
+"""
+import random
+from collections import deque
+import numpy
+from pyics import Model
+from ipd_simulation.strategies import non_genetic_strategies, payoff_matrix
+from ipd_simulation.match_tournament import OUTCOMES, run_match, run_tournament
+from ipd_simulation.instrumentation import instruments
+from ipd_simulation.checkpoint import random_state, restore_random_state, write_checkpoint, read_checkpoint
+from ipd_simulation.ecology import DYNAMICS, payoff_table, replicator_step, moran_step, wright_fisher_step, even_counts
+from ipd_simulation.spatial import NEIGHBOURHOODS, UPDATE_RULES, random_grid, spatial_step, grid_shares
+from ipd_simulation.genetic_backend import GeneticRun, PopulationEvaluator, ScoreCache, make_genetic_strategy
+
+# Number of log lines the simulation keeps
+LOG_LINES = 1000
+
+# Parameters that belong to the machine or the checkpoint itself, they are
+# not taken over when restoring a checkpoint
+LOCAL_PARAMS = ("executor", "workers", "checkpoint_file", "checkpoint_interval", "resume", "instrument",
+                "instrument_file")
+
+
+class IPDSimulation(Model):
+    """
+    The main simulation class for running the Iterated Prisoner's Dilemma.
+
+    Four modes:
+    1. Tournament: Multiple strategies compete over multiple generations.
+    2. Match: A one-on-one match between two strategies.
+    3. Ecology: The shares of the non-genetic strategies in a population
+       evolve by replicator, Moran or Wright-Fisher dynamics over a single
+       tournament.
+    4. Spatial: The non-genetic strategies occupy a toroidal grid and
+       imitate their most successful neighbours.
+    """
+
+    def __init__(self):
+        """Initializes the simulation parameters, strategies, and variables."""
+        Model.__init__(self)
+
+        # Simulation parameters
+        self.make_param('mode', 'Tournament', str)
+        self.make_param('rounds_per_match', 200, int)
+        self.make_param('population_size', 100, int)
+        self.make_param('num_generations', 50, int)
+        self.make_param('mutation_rate', 0.1, float)
+        self.make_param('survivor_fraction', 0.7, float)
+        self.make_param('memory', 3, int)
+
+        # Fitness evaluation: 'serial', 'thread' or 'process', with the
+        # number of workers (0 uses all cores)
+        self.make_param('executor', 'serial', str)
+        self.make_param('workers', 0, int)
+
+        # Stop evaluating individuals that can no longer survive, which
+        # selects the same survivors with fewer matches
+        self.make_param('racing', False, bool)
+
+        # Let all individuals of a generation meet the stochastic opponents
+        # with the same random numbers
+        self.make_param('common_random_numbers', False, bool)
+
+        # Dynamics of Ecology mode: 'Replicator', 'Moran' or 'Wright-Fisher'
+        self.make_param('ecology_dynamics', 'Replicator', str)
+
+        # Spatial mode: side of the grid, 'Moore' or 'von Neumann'
+        # neighbourhood and 'Best' or 'Fermi' imitation
+        self.make_param('grid_size', 100, int)
+        self.make_param('neighbourhood', 'Moore', str)
+        self.make_param('spatial_update', 'Best', str)
+
+        # Checkpoints of the genetic algorithm: saved to checkpoint_file every
+        # checkpoint_interval generations (0 never), and with resume set a
+        # reset continues from the file instead of starting a new run
+        self.make_param('checkpoint_file', 'ipd_checkpoint.npz', str)
+        self.make_param('checkpoint_interval', 0, int)
+        self.make_param('resume', False, bool)
+
+        # Counters and timers of the hot paths, written per generation to
+        # instrument_file (CSV, or JSON lines for .jsonl) when it is set
+        self.make_param('instrument', False, bool)
+        self.make_param('instrument_file', '', str)
+
+        # Strategies for non-genetic match
+        self.make_param('strategy_A', 'Tit for Tat', str)
+        self.make_param('strategy_B', 'Always Defect', str)
+
+        # Initialize variables
+        self.phase = None
+        self.current_generation = 0
+        self.genetic_run = None
+        self.population = None
+        self.best_individual = None
+        self.best_fitness = None
+        self.gens = []
+        self.max_fitnesses = []
+        self.log_lines = deque(maxlen=LOG_LINES)
+        self.finished = False
+        self.match_result = None
+        self.plot = None
+        self.payoff_table = None
+        self.shares = []
+        self.grid = None
+
+        # Scores of genomes against deterministic opponents, so survivors and
+        # duplicate children are not played again every generation
+        self.score_cache = ScoreCache()
+        self.evaluator = None
+
+        self.non_genetic_strategies = non_genetic_strategies
+
+    def reset(self):
+        """Resets the simulation"""
+        # Update the payoff matrix if GUI is available
+        if hasattr(self, 'gui') and self.gui is not None:
+            new_matrix = self.gui.get_payoff_matrix()
+            payoff_matrix.clear()
+            payoff_matrix.update(new_matrix)
+
+        instruments.reset(self.instrument, self.instrument_file)
+
+        # Reset variables
+        self.current_generation = 0
+        self.gens = []
+        self.max_fitnesses = []
+        self.log_lines.clear()
+        self.finished = False
+        self.score_cache.clear()
+        if self.plot is not None:
+            self.plot["kind"] = None
+
+        self.shares = []
+        self.grid = None
+
+        # Validate mode selection
+        if self.mode not in ("Tournament", "Match", "Ecology", "Spatial"):
+            self.phase = "error"
+            self.append_log("Invalid mode value '" + str(self.mode) + "'. Use 'Tournament', 'Match', 'Ecology' or 'Spatial'.")
+            return
+        if self.mode == "Ecology" and self.ecology_dynamics not in DYNAMICS:
+            self.phase = "error"
+            self.append_log("Invalid ecology_dynamics value '" + str(self.ecology_dynamics) + "'. Use one of " +
+                            str(DYNAMICS) + ".")
+            return
+        if self.mode == "Spatial":
+            if self.grid_size < 3:
+                self.phase = "error"
+                self.append_log("Invalid grid_size value '" + str(self.grid_size) + "'. Use 3 or more.")
+                return
+            if self.neighbourhood not in NEIGHBOURHOODS:
+                self.phase = "error"
+                self.append_log("Invalid neighbourhood value '" + str(self.neighbourhood) + "'. Use 'Moore' or 'von Neumann'.")
+                return
+            if self.spatial_update not in UPDATE_RULES:
+                self.phase = "error"
+                self.append_log("Invalid spatial_update value '" + str(self.spatial_update) + "'. Use 'Best' or 'Fermi'.")
+                return
+
+        # Validate memory depth of the evolved strategies
+        if not 1 <= self.memory <= 8:
+            self.phase = "error"
+            self.append_log("Invalid memory value '" + str(self.memory) + "'. Use 1 through 8.")
+            return
+
+        # Validate executor selection, the worker pool is kept across resets
+        # as long as the executor settings do not change
+        if self.executor not in PopulationEvaluator.EXECUTORS:
+            self.phase = "error"
+            self.append_log("Invalid executor value '" + str(self.executor) + "'. Use 'serial', 'thread' or 'process'.")
+            return
+        if self.evaluator is None or (self.evaluator.executor, self.evaluator.workers) != (self.executor, self.workers):
+            if self.evaluator is not None:
+                self.evaluator.close()
+            self.evaluator = PopulationEvaluator(self.executor, self.workers)
+
+        self.best_individual = None
+        self.best_fitness = None
+
+        # Continue a run from its checkpoint
+        if self.resume:
+            if hasattr(self, 'gui') and self.gui is not None:
+                self.gui.clear_terminal()
+            try:
+                self.restore_checkpoint()
+            except (OSError, ValueError, KeyError) as error:
+                self.phase = "error"
+                self.append_log(f"Could not restore checkpoint '{self.checkpoint_file}': {error}")
+            return
+
+        # Initialize simulation based on mode
+        if self.mode == "Tournament":
+            self.phase = "genetic_phase"
+            self.start_genetic_run(self.non_genetic_strategies)
+        elif self.mode == "Match":
+            self.phase = "match"
+        elif self.mode == "Ecology":
+            self.phase = "ecology_tournament"
+            self.rng = numpy.random.default_rng(random.getrandbits(64))
+        elif self.mode == "Spatial":
+            self.phase = "spatial_tournament"
+            self.rng = numpy.random.default_rng(random.getrandbits(64))
+
+        # Clear GUI terminal if available
+        if hasattr(self, 'gui') and self.gui is not None:
+            self.gui.clear_terminal()
+        self.append_log("Simulation reset. Mode: " + self.mode)
+
+    def step(self):
+        """Executes a single step in the simulation"""
+        if self.phase == "error":
+            return True
+
+        if self.mode == "Tournament":
+            # Handle genetic algorithm steps
+            if self.phase == "initial_tournament":
+                self.append_log("Running initial tournament among non-genetic strategies...")
+                with instruments.timer("tournament_seconds"):
+                    results = run_tournament(self.non_genetic_strategies, self.rounds_per_match, self.tournament_workers())
+                for name, score in results.items():
+                    self.append_log(f"{name}: {score}")
+                self.start_genetic_run(self.non_genetic_strategies)
+                self.current_generation = 0
+                self.phase = "genetic_phase"
+                return False
+            elif self.phase == "genetic_phase":
+                gen_best_individual, gen_best_fitness = self.evolve()
+                if self.current_generation >= self.num_generations - 1:
+                    self.best_individual = gen_best_individual
+                    self.best_fitness = gen_best_fitness
+                    self.phase = "final_tournament"
+                else:
+                    self.current_generation += 1
+                self.periodic_checkpoint()
+                return False
+            elif self.phase == "final_tournament":
+                genetic_strategy = make_genetic_strategy(self.best_individual)
+                strategies = self.non_genetic_strategies.copy()
+                strategies["Genetic Strategy"] = genetic_strategy
+                self.append_log("Running final tournament including Genetic Strategy...")
+                with instruments.timer("tournament_seconds"):
+                    results = run_tournament(strategies, self.rounds_per_match, self.tournament_workers())
+                for name, score in results.items():
+                    self.append_log(f"{name}: {score}")
+
+                self.append_log(f"Overall Best Fitness: {self.best_fitness}")
+                self.phase = "finished"
+                self.finished = True
+                return True
+
+        elif self.mode == "Ecology":
+            if self.phase == "ecology_tournament":
+                self.append_log("Running tournament to build the payoff table...")
+                with instruments.timer("tournament_seconds"):
+                    self.payoff_table = payoff_table(self.non_genetic_strategies, self.rounds_per_match,
+                                                     self.tournament_workers())
+
+                # Start with every strategy equally present
+                strategy_count = len(self.non_genetic_strategies)
+                if self.ecology_dynamics == "Replicator":
+                    self.shares = [numpy.full(strategy_count, 1 / strategy_count)]
+                else:
+                    counts = even_counts(self.population_size, strategy_count)
+                    self.shares = [counts / counts.sum()]
+                    self.counts = counts
+                self.gens.append(0)
+                self.phase = "ecology"
+                return False
+            elif self.phase == "ecology":
+                # Advance the population one generation without playing
+                if self.ecology_dynamics == "Replicator":
+                    self.shares.append(replicator_step(self.shares[-1], self.payoff_table))
+                elif self.ecology_dynamics == "Moran":
+                    self.counts = moran_step(self.counts, self.payoff_table, self.rng)
+                    self.shares.append(self.counts / self.counts.sum())
+                else:
+                    self.counts = wright_fisher_step(self.counts, self.payoff_table, self.rng)
+                    self.shares.append(self.counts / self.counts.sum())
+                self.current_generation += 1
+                self.gens.append(self.current_generation)
+
+                if self.current_generation >= self.num_generations:
+                    self.append_log(f"Shares after {self.current_generation} generations:")
+                    for name, share in zip(self.non_genetic_strategies, self.shares[-1]):
+                        self.append_log(f"{name}: {share:.4f}")
+                    self.phase = "finished"
+                    self.finished = True
+                    return True
+                return False
+
+        elif self.mode == "Spatial":
+            if self.phase == "spatial_tournament":
+                self.append_log("Running tournament to build the payoff table...")
+                with instruments.timer("tournament_seconds"):
+                    self.payoff_table = payoff_table(self.non_genetic_strategies, self.rounds_per_match,
+                                                     self.tournament_workers())
+                strategy_count = len(self.non_genetic_strategies)
+                self.grid = random_grid(self.grid_size, strategy_count, self.rng)
+                self.shares = [grid_shares(self.grid, strategy_count)]
+                self.gens.append(0)
+                self.phase = "spatial"
+                return False
+            elif self.phase == "spatial":
+                # Play every cell against its neighbours and imitate
+                self.grid, payoffs = spatial_step(self.grid, self.payoff_table, self.rng,
+                                                  self.neighbourhood, self.spatial_update)
+                self.shares.append(grid_shares(self.grid, len(self.non_genetic_strategies)))
+                self.current_generation += 1
+                self.gens.append(self.current_generation)
+
+                if self.current_generation >= self.num_generations:
+                    self.append_log(f"Shares after {self.current_generation} generations:")
+                    for name, share in zip(self.non_genetic_strategies, self.shares[-1]):
+                        self.append_log(f"{name}: {share:.4f}")
+                    self.phase = "finished"
+                    self.finished = True
+                    return True
+                return False
+
+        elif self.mode == "Match":
+            if self.phase == "match":
+                # Validate selected strategies
+                valid_strategies = list(self.non_genetic_strategies.keys()) + ["Genetic Strategy"]
+                strat_A_name = self.strategy_A
+                strat_B_name = self.strategy_B
+                if strat_A_name not in valid_strategies:
+                    self.append_log(f"Strategy A '{strat_A_name}' is invalid. Valid options: {valid_strategies}")
+                    self.phase = "error"
+                    return True
+                if strat_B_name not in valid_strategies:
+                    self.append_log(f"Strategy B '{strat_B_name}' is invalid. Valid options: {valid_strategies}")
+                    self.phase = "error"
+                    return True
+                if strat_A_name == "Genetic Strategy" and strat_B_name == "Genetic Strategy":
+                    self.append_log("Both strategies cannot be 'Genetic Strategy'.")
+                    self.phase = "error"
+                    return True
+
+                # Evolve the Genetic Strategy one generation per step first
+                if "Genetic Strategy" in (strat_A_name, strat_B_name):
+                    if self.num_generations < 1:
+                        self.append_log("Invalid num_generations value '" + str(self.num_generations) + "'. Use 1 or more.")
+                        self.phase = "error"
+                        return True
+                    opponents = self.match_opponents()
+                    self.append_log("Evolving Genetic Strategy for match against " + next(iter(opponents)) + "...")
+                    self.start_genetic_run(opponents)
+                    self.current_generation = 0
+                    self.phase = "match_evolution"
+                    return False
+
+                return self.play_match(self.non_genetic_strategies)
+            elif self.phase == "match_evolution":
+                self.evolve()
+                self.current_generation += 1
+                if self.current_generation < self.num_generations:
+                    self.periodic_checkpoint()
+                    return False
+
+                # Play the match with the best individual of all generations
+                strategies_for_match = self.non_genetic_strategies.copy()
+                strategies_for_match["Genetic Strategy"] = make_genetic_strategy(self.genetic_run.best_individual)
+                self.append_log(f"Evolved Genetic Strategy with fitness {self.genetic_run.best_fitness}")
+                return self.play_match(strategies_for_match)
+        return True
+
+    def start_genetic_run(self, opponents):
+        """Starts a genetic algorithm run against the opponents with a random
+        population, sharing the score cache and evaluator of the simulation"""
+        self.genetic_run = GeneticRun(opponents, self.population_size, self.rounds_per_match, self.mutation_rate,
+                                      self.survivor_fraction, self.memory, self.score_cache, self.evaluator,
+                                      self.racing, self.common_random_numbers)
+        self.population = self.genetic_run.population
+
+    def evolve(self):
+        """Runs one generation of the genetic algorithm and records its best
+        fitness. Returns the best individual and fitness of the generation"""
+        # Parameters saved during a run take effect from the next generation
+        run = self.genetic_run
+        run.rounds = self.rounds_per_match
+        run.mutation_rate = self.mutation_rate
+        run.survivor_fraction = self.survivor_fraction
+        run.racing = self.racing
+        run.common_random_numbers = self.common_random_numbers
+
+        generation, best_individual, best_fitness = run.step()
+        if instruments.enabled:
+            instruments.end_generation(generation)
+        self.population = run.population
+        self.append_log(f"Generation {generation}: Best Fitness = {best_fitness}")
+        self.gens.append(generation)
+        self.max_fitnesses.append(best_fitness)
+        return best_individual, best_fitness
+
+    def match_opponents(self):
+        """The opponent of the Genetic Strategy in Match mode"""
+        opponent_name = self.strategy_B if self.strategy_A == "Genetic Strategy" else self.strategy_A
+        return {opponent_name: self.non_genetic_strategies[opponent_name]}
+
+    def periodic_checkpoint(self):
+        """Saves a checkpoint every checkpoint_interval generations"""
+        if self.checkpoint_interval > 0 and len(self.max_fitnesses) % self.checkpoint_interval == 0:
+            self.save_checkpoint()
+            self.append_log(f"Saved checkpoint '{self.checkpoint_file}'")
+
+    def save_checkpoint(self, path=None):
+        """Saves the state of a genetic algorithm run, between two steps, so
+        restore_checkpoint continues it exactly as if it never stopped"""
+        if self.phase not in ("genetic_phase", "final_tournament", "match_evolution"):
+            raise ValueError(f"Cannot checkpoint phase '{self.phase}', only genetic algorithm runs")
+        run = self.genetic_run
+        values = {
+            "params": {name: getattr(self, name) for name in self.params if name not in LOCAL_PARAMS},
+            "phase": self.phase,
+            "current_generation": self.current_generation,
+            "best_fitness": self.best_fitness,
+            "run_generation": run.generation,
+            "run_best_fitness": run.best_fitness,
+        }
+        arrays = {
+            "population": run.population,
+            "gens": numpy.array(self.gens, dtype=numpy.int64),
+            "max_fitnesses": numpy.array(self.max_fitnesses, dtype=numpy.float64),
+            "run_best_individual": numpy.frombuffer(run.best_individual or b"", dtype=numpy.uint8),
+            "best_individual": numpy.frombuffer(self.best_individual or b"", dtype=numpy.uint8),
+            "payoff_matrix": numpy.array([payoff_matrix[outcome] for outcome in OUTCOMES]),
+        }
+        arrays.update(random_state())
+        write_checkpoint(path or self.checkpoint_file, arrays, values)
+
+    def restore_checkpoint(self, path=None):
+        """Restores the run saved by save_checkpoint"""
+        arrays, values = read_checkpoint(path or self.checkpoint_file)
+        for name, value in values["params"].items():
+            setattr(self, name, value)
+        payoff_matrix.clear()
+        payoff_matrix.update((outcome, tuple(int(payoff) for payoff in payoffs))
+                             for outcome, payoffs in zip(OUTCOMES, arrays["payoff_matrix"]))
+        self.score_cache.clear()
+
+        self.phase = values["phase"]
+        self.current_generation = values["current_generation"]
+        self.gens = arrays["gens"].tolist()
+        self.max_fitnesses = arrays["max_fitnesses"].tolist()
+        self.best_individual = arrays["best_individual"].tobytes() or None
+        self.best_fitness = values["best_fitness"]
+
+        opponents = self.match_opponents() if self.mode == "Match" else self.non_genetic_strategies
+        self.start_genetic_run(opponents)
+        run = self.genetic_run
+        run.population = self.population = arrays["population"]
+        run.generation = values["run_generation"]
+        run.best_individual = arrays["run_best_individual"].tobytes() or None
+        run.best_fitness = values["run_best_fitness"]
+
+        # Last, starting the run above draws a population
+        restore_random_state(arrays)
+        self.append_log(f"Restored checkpoint '{path or self.checkpoint_file}' at generation {len(self.max_fitnesses)}")
+
+    def play_match(self, strategies_for_match):
+        """Plays the match between strategy A and B and finishes the run"""
+        strat_A_name = self.strategy_A
+        strat_B_name = self.strategy_B
+        strat_A = strategies_for_match.get(strat_A_name)
+        strat_B = strategies_for_match.get(strat_B_name)
+        self.append_log(f"Running match: {strat_A_name} vs {strat_B_name}")
+        with instruments.timer("tournament_seconds"):
+            history_A, history_B, score_A, score_B = run_match(strat_A, strat_B, self.rounds_per_match)
+        self.append_log("Match Results:")
+        self.append_log(f"{strat_A_name}: {score_A}")
+        self.append_log(f"{strat_B_name}: {score_B}")
+        self.phase = "finished"
+        self.finished = True
+        return True
+
+    def tournament_workers(self):
+        """Tournaments are sharded over processes with the process executor"""
+        return self.workers if self.executor == "process" else 1
+
+    @property
+    def cache_hits(self):
+        """Number of match scores taken from the score cache since reset"""
+        return self.score_cache.hits
+
+    @property
+    def cache_misses(self):
+        """Number of match scores that had to be played since reset"""
+        return self.score_cache.misses
+
+    @property
+    def matches_played(self):
+        """Number of matches played since reset, when instrumented"""
+        return instruments.snapshot()["matches_played"]
+
+    @property
+    def rounds_simulated(self):
+        """Number of rounds of those matches, skipped cycles included"""
+        return instruments.snapshot()["rounds_simulated"]
+
+    @property
+    def strategy_calls(self):
+        """Number of calls of strategies for a move since reset"""
+        return instruments.snapshot()["strategy_calls"]
+
+    @property
+    def evaluation_seconds(self):
+        """Time spent evaluating populations since reset"""
+        return instruments.snapshot()["evaluation_seconds"]
+
+    @property
+    def selection_seconds(self):
+        """Time spent selecting survivors since reset"""
+        return instruments.snapshot()["selection_seconds"]
+
+    @property
+    def variation_seconds(self):
+        """Time spent on crossover and mutation since reset"""
+        return instruments.snapshot()["variation_seconds"]
+
+    @property
+    def tournament_seconds(self):
+        """Time spent in tournaments and single matches since reset"""
+        return instruments.snapshot()["tournament_seconds"]
+
+    @property
+    def drawing_seconds(self):
+        """Time spent drawing since reset"""
+        return instruments.snapshot()["drawing_seconds"]
+
+    def instrument_totals(self):
+        """All counters and timers since reset as a dict"""
+        return instruments.snapshot()
+
+    def export_instruments(self, path):
+        """Writes the counters and timers of every generation to a CSV file,
+        or a JSON lines file when path ends with .jsonl"""
+        instruments.export(path)
+
+    def draw(self):
+        """Updates the GUI by plotting the evolution of the genetic algorithm,
+        the population shares or the spatial grid. The artists are kept
+        between calls and only their data is updated"""
+        with instruments.timer("drawing_seconds"):
+            self.draw_plot()
+
+    def draw_plot(self):
+        """Draws the plot of the current mode"""
+        import matplotlib.pyplot as plt
+
+        # The simulation may be stepping in another thread, only draw the
+        # generations of which all values have been recorded
+        if (self.mode == "Tournament" and self.phase in ["genetic_phase", "final_tournament", "finished"]) or \
+                (self.mode == "Match" and self.max_fitnesses):
+            generations = min(len(self.gens), len(self.max_fitnesses))
+            self.draw_lines(plt, "fitness", self.gens[:generations], [self.max_fitnesses[:generations]],
+                            "Genetic Algorithm Evolution", "Max Fitness")
+        if self.mode == "Ecology" and self.shares:
+            generations = min(len(self.gens), len(self.shares))
+            shares = numpy.array(self.shares[:generations])
+            self.draw_lines(plt, "shares", self.gens[:generations], shares.T,
+                            self.ecology_dynamics + " Dynamics", "Population Share",
+                            labels=list(self.non_genetic_strategies), ylim=(0, 1))
+        if self.mode == "Spatial" and self.grid is not None:
+            self.draw_grid(plt)
+
+    def new_plot(self, plt, kind):
+        """Clears the figure for a new kind of plot, unless the figure still
+        shows this kind of plot"""
+        figure = plt.gcf()
+        if self.plot is not None and self.plot["kind"] == kind and self.plot["figure"] is figure \
+                and self.plot["axes"] in figure.axes:
+            return False
+        if self.plot is not None and "connection" in self.plot:
+            self.plot["figure"].canvas.mpl_disconnect(self.plot["connection"])
+        plt.clf()
+        self.plot = {"kind": kind, "figure": figure, "axes": plt.gca(), "background": None}
+        return True
+
+    def draw_lines(self, plt, kind, x, ys, title, ylabel, labels=None, ylim=None):
+        """Plots lines against the generations. The axes only grow when the
+        data leaves them, until then only the lines are redrawn by blitting
+        them onto the axes saved at the last full redraw. The lines only get
+        longer, so the part already in the saved axes is simply drawn over"""
+        if self.new_plot(plt, kind):
+            axes = self.plot["axes"]
+            labels = labels or [None] * len(ys)
+            self.plot["lines"] = [axes.plot([], [], label=label)[0] for label in labels]
+            axes.set_xlabel("Generation")
+            axes.set_ylabel(ylabel)
+            axes.set_title(title)
+            if labels[0] is not None:
+                axes.legend(fontsize="small")
+            axes.set_xlim(0, 10)
+            # Without limits the axes start at the first values
+            self.plot["ylim"] = ylim
+            if ylim is not None:
+                axes.set_ylim(*ylim)
+
+            # A full redraw (first draw, resize) saves a new background
+            canvas = self.plot["figure"].canvas
+            plot = self.plot
+            plot["connection"] = canvas.mpl_connect("draw_event", lambda event: self.save_background(plot))
+
+        axes, lines = self.plot["axes"], self.plot["lines"]
+        for line, y in zip(lines, ys):
+            line.set_data(x, y)
+
+        # Grow the axes in steps, so they rarely have to be redrawn
+        rescale = False
+        if len(x) and x[-1] > axes.get_xlim()[1]:
+            axes.set_xlim(0, 2 * x[-1])
+            rescale = True
+        if len(x):
+            y_min = min(numpy.min(y) for y in ys)
+            y_max = max(numpy.max(y) for y in ys)
+            low, high = self.plot["ylim"] or (y_min, y_max)
+            if self.plot["ylim"] is None or y_min < low or y_max > high:
+                low, high = min(low, y_min), max(high, y_max)
+                margin = 0.1 * (high - low) or 0.05
+                self.plot["ylim"] = (low - margin, high + margin)
+                axes.set_ylim(*self.plot["ylim"])
+                rescale = True
+
+        canvas = self.plot["figure"].canvas
+        if rescale or self.plot["background"] is None or not getattr(canvas, "supports_blit", False):
+            canvas.draw()
+        else:
+            canvas.restore_region(self.plot["background"])
+            for line in lines:
+                axes.draw_artist(line)
+            canvas.blit(axes.bbox)
+
+    def save_background(self, plot):
+        """Saves the axes after a full redraw to blit the lines onto"""
+        canvas = plot["figure"].canvas
+        if getattr(canvas, "supports_blit", False):
+            plot["background"] = canvas.copy_from_bbox(plot["axes"].bbox)
+
+    def draw_grid(self, plt):
+        """Shows the spatial grid, updating the image of the previous draw"""
+        if self.new_plot(plt, "grid"):
+            strategy_count = len(self.non_genetic_strategies)
+            colours = plt.get_cmap("tab10" if strategy_count <= 10 else "tab20", strategy_count)
+            self.plot["image"] = plt.imshow(self.grid, cmap=colours, vmin=-0.5, vmax=strategy_count - 0.5,
+                                            interpolation="nearest")
+            colourbar = plt.colorbar(ticks=range(strategy_count))
+            colourbar.ax.set_yticklabels(list(self.non_genetic_strategies), fontsize="small")
+            plt.axis("off")
+        self.plot["image"].set_data(self.grid)
+        self.plot["axes"].set_title(f"Generation {self.current_generation}")
+        self.plot["figure"].canvas.draw_idle()
+
+    @property
+    def log(self):
+        """The most recent log lines as a single string"""
+        return "".join(line + "\n" for line in self.log_lines)
+
+    def append_log(self, message):
+        # Only the last LOG_LINES lines are kept
+        self.log_lines.append(message)
+        # The GUI shows the line from its own thread
+        if hasattr(self, 'gui') and self.gui is not None:
+            self.gui.post('log', message)
@@ -0,0 +1,125 @@
+"""
+Naam: Simon Plas, Boris Vukaljovic
+UvAID: 15249514, 15225054
+Description:
+Implements the spatial Iterated Prisoner's Dilemma on a toroidal grid. Every
+cell holds the id of a strategy, plays its neighbours with the scores of a
+precomputed payoff table and then imitates one of its neighbours. All steps
+are whole-grid array operations, so large grids update at interactive rates.
+"""
+import numpy
+
+# Offsets of the neighbours of a cell, the cell itself is not a neighbour
+NEIGHBOURHOODS = {
+    "Moore": [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)],
+    "von Neumann": [(-1, 0), (0, -1), (0, 1), (1, 0)],
+}
+UPDATE_RULES = ("Best", "Fermi")
+
+
+# Grid of the given size with a uniformly random strategy id in every cell
+def random_grid(size, strategy_count, rng):
+    return rng.integers(0, strategy_count, size=(size, size), dtype=numpy.uint8)
+
+
+# The grid with a border of one cell copied from the opposite edges, so the
+# neighbours of every cell can be taken as views instead of rolled copies
+def wrap(grid):
+    return numpy.pad(grid, 1, mode="wrap")
+
+
+# View of a wrapped grid in which every cell holds the value of its
+# neighbour at offset
+def neighbour(wrapped, offset):
+    rows, columns = wrapped.shape[0] - 2, wrapped.shape[1] - 2
+    return wrapped[1 + offset[0]:1 + offset[0] + rows, 1 + offset[1]:1 + offset[1] + columns]
+
+
+# Total payoff of every cell against all its neighbours, wrapped like the
+# grid so imitation can take neighbour views of it. The table is looked up
+# through its flat index: per neighbour one addition and one gather into
+# buffers that are reused, accumulated in place
+def wrapped_payoffs(grid, table, neighbourhood="Moore"):
+    flat_table = table.ravel()
+    rows = grid.astype(numpy.intp)
+    rows *= table.shape[1]
+    wrapped = wrap(grid)
+    index = numpy.empty(grid.shape, dtype=numpy.intp)
+    gathered = numpy.empty(grid.shape, dtype=flat_table.dtype)
+    payoffs = numpy.zeros(grid.shape, dtype=flat_table.dtype)
+    for offset in NEIGHBOURHOODS[neighbourhood]:
+        numpy.add(rows, neighbour(wrapped, offset), out=index)
+        numpy.take(flat_table, index, out=gathered, mode="clip")
+        payoffs += gathered
+    return wrap(payoffs)
+
+
+# Total payoff of every cell against all its neighbours
+def grid_payoffs(grid, table, neighbourhood="Moore"):
+    return neighbour(wrapped_payoffs(grid, table, neighbourhood), (0, 0))
+
+
+# Every cell adopts the strategy of the highest scoring cell in its
+# neighbourhood, itself included. Ties keep the own strategy. The payoffs may
+# be wrapped, see wrapped_payoffs. A better neighbour is copied without
+# branching, by adding the wrapping difference of the strategy ids times the
+# comparison, as masked copies are slow on random masks
+def imitate_best(grid, payoffs, neighbourhood="Moore"):
+    if payoffs.shape == grid.shape:
+        payoffs = wrap(payoffs)
+    wrapped = wrap(grid)
+    best = grid.copy()
+    best_payoffs = neighbour(payoffs, (0, 0)).copy()
+    better = numpy.empty(grid.shape, dtype=bool)
+    difference = numpy.empty(grid.shape, dtype=grid.dtype)
+    for offset in NEIGHBOURHOODS[neighbourhood]:
+        neighbour_payoffs = neighbour(payoffs, offset)
+        numpy.greater(neighbour_payoffs, best_payoffs, out=better)
+        numpy.subtract(neighbour(wrapped, offset), best, out=difference)
+        numpy.multiply(difference, better, out=difference)
+        best += difference
+        numpy.maximum(best_payoffs, neighbour_payoffs, out=best_payoffs)
+    return best
+
+
+# Every cell compares itself with one random neighbour and adopts its
+# strategy with the Fermi probability of the payoff difference, so better
+# neighbours are copied more often but not always. The payoffs may be
+# wrapped, see wrapped_payoffs. The chosen neighbours are gathered through
+# their flat index in the wrapped arrays
+def imitate_fermi(grid, payoffs, rng, neighbourhood="Moore", noise=0.1):
+    if payoffs.shape == grid.shape:
+        payoffs = wrap(payoffs)
+    offsets = NEIGHBOURHOODS[neighbourhood]
+    chosen = rng.integers(0, len(offsets), size=grid.shape)
+    rows, columns = grid.shape
+    steps = numpy.array([row * (columns + 2) + column for row, column in offsets])
+    cells = numpy.arange(1, rows + 1)[:, None] * (columns + 2) + numpy.arange(1, columns + 1)
+    index = steps[chosen]
+    index += cells
+    model_grid = wrap(grid).ravel().take(index)
+    model_payoffs = payoffs.ravel().take(index)
+    own_payoffs = neighbour(payoffs, (0, 0))
+
+    # Payoffs are scaled per neighbour, so the noise does not depend on the
+    # size of the neighbourhood
+    difference = (model_payoffs - own_payoffs) / len(offsets)
+    exponent = numpy.minimum(-difference / noise, 700)
+    adopt = rng.random(grid.shape) * (1 + numpy.exp(exponent)) < 1
+    return numpy.where(adopt, model_grid, grid)
+
+
+# One generation: every cell plays its neighbours and then updates its
+# strategy. Returns the new grid and the payoffs of the old one
+def spatial_step(grid, table, rng, neighbourhood="Moore", rule="Best"):
+    payoffs = wrapped_payoffs(grid, table, neighbourhood)
+    if rule == "Best":
+        new_grid = imitate_best(grid, payoffs, neighbourhood)
+    else:
+        new_grid = imitate_fermi(grid, payoffs, rng, neighbourhood)
+    return new_grid, neighbour(payoffs, (0, 0))
+
+
+# Share of the grid held by every strategy
+def grid_shares(grid, strategy_count):
+    return numpy.bincount(grid.ravel(), minlength=strategy_count) / grid.size
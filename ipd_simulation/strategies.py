@@ -6,6 +6,8 @@ Defines various non-genetic strategies for the Iterated Prisoner's Dilemma,
 including Tit-For-Tat, random, adaptive and other strategies.
 """
 import random
+from collections import deque
+import numpy
 
 COOPERATE = 'C'
 DEFECT = 'D'
@@ -18,17 +20,84 @@ payoff_matrix = {
 }
 
 
+# Declares a strategy deterministic with bounded state: once `warmup` rounds
+# have been played, its move only depends on the last `memory` moves of both
+# players and on the round number modulo `period`. The match engine uses this
+# to detect repeating joint states and extrapolate the rest of a match.
+def finite_memory(memory, warmup=0, period=1):
+    def declare(strategy):
+        strategy.deterministic = True
+        strategy.memory = memory
+        strategy.warmup = max(warmup, memory)
+        strategy.period = period
+        return strategy
+    return declare
+
+
+# Declares that a strategy only reads the last `depth` moves of the histories
+# (and not their length), so the match engine only needs to keep a window of
+# that many moves when full histories are not requested. Incremental
+# strategies do not read histories at all.
+def bounded_history(depth):
+    def declare(strategy):
+        strategy.history_depth = depth
+        return strategy
+    return declare
+
+
+# Declares that the behaviour of a strategy depends on the payoff matrix, so
+# a match involving it has to be replayed when the matrix changes instead of
+# rescoring its outcome counts.
+def payoff_dependent(strategy):
+    strategy.payoff_dependent = True
+    return strategy
+
+
+# Declares the probability that a strategy cooperates as a function of the
+# last `memory` moves of both players (fewer in the first rounds), so matches
+# against other such strategies can be evaluated exactly as a Markov chain,
+# see match_tournament.expected_match.
+def markov(memory, probability):
+    def declare(strategy):
+        strategy.markov_memory = memory
+        if isinstance(strategy, type):
+            probability_function = staticmethod(probability)
+        else:
+            probability_function = probability
+        strategy.cooperation_probability = probability_function
+        return strategy
+    return declare
+
+
+# Probability that win-stay lose-shift cooperates after the given moves
+def win_stay_lose_shift_probability(my_last, opponent_last):
+    if not my_last:
+        return 1.0
+    last_payoff, _ = payoff_matrix[(my_last[-1], opponent_last[-1])]
+    stays = last_payoff >= 3
+    return 1.0 if (my_last[-1] == COOPERATE) == stays else 0.0
+
+
 # Always cooperate
+@finite_memory(0)
+@bounded_history(0)
+@markov(0, lambda my_last, opponent_last: 1.0)
 def always_cooperate(my_history, opponent_history):
     return COOPERATE
 
 
 # Always defect
+@finite_memory(0)
+@bounded_history(0)
+@markov(0, lambda my_last, opponent_last: 0.0)
 def always_defect(my_history, opponent_history):
     return DEFECT
 
 
 # Tit for tat, copy opponents last move
+@finite_memory(1)
+@bounded_history(1)
+@markov(1, lambda my_last, opponent_last: 0.0 if DEFECT in opponent_last else 1.0)
 def tit_for_tat(my_history, opponent_history):
     if not opponent_history:
         return COOPERATE
@@ -36,6 +105,10 @@ def tit_for_tat(my_history, opponent_history):
 
 
 # Cooperate until opponent defects once, and then defect forever
+# Within a match this only depends on the last round: either the opponent just
+# defected or this strategy has been defecting since
+@finite_memory(1)
+@markov(1, lambda my_last, opponent_last: 0.0 if DEFECT in my_last + opponent_last else 1.0)
 def grim_trigger(my_history, opponent_history):
     if DEFECT in opponent_history:
         return DEFECT
@@ -44,6 +117,10 @@ def grim_trigger(my_history, opponent_history):
 
 # If the last rounds outcome has a good scare, repeat last move.
 # Otherwise switch move
+@finite_memory(1)
+@bounded_history(1)
+@payoff_dependent
+@markov(1, win_stay_lose_shift_probability)
 def win_stay_lose_shift(my_history, opponent_history):
     if not my_history:
         return COOPERATE
@@ -59,11 +136,15 @@ def win_stay_lose_shift(my_history, opponent_history):
 
 
 # Randomly select between cooperate and defect
+@bounded_history(0)
+@markov(0, lambda my_last, opponent_last: 0.5)
 def random_strategy(my_history, opponent_history):
     return random.choice([COOPERATE, DEFECT])
 
 
 # Tit for tat but has a 70% to cooperate if opponents defect, thus is forgiving
+@bounded_history(1)
+@markov(1, lambda my_last, opponent_last: 0.7 if DEFECT in opponent_last else 1.0)
 def generous_tit_for_tat(my_history, opponent_history):
     if not opponent_history:
         return COOPERATE
@@ -74,6 +155,7 @@ def generous_tit_for_tat(my_history, opponent_history):
 
 
 # Alternates every two rounds between cooperate and defect
+@finite_memory(0, period=4)
 def double_alternator(my_history, opponent_history):
     round_number = len(my_history)
 
@@ -84,7 +166,9 @@ def double_alternator(my_history, opponent_history):
 
 
 # Starts with four rounds of cooperate, then tries to defect. If opponent
-# also defects then tit for that.
+# also defects then tit for that. After the probe the answer to it is fixed,
+# so only the last round matters.
+@finite_memory(1, warmup=5)
 def prober(my_history, opponent_history):
     if len(my_history) < 4:
         return COOPERATE
@@ -98,6 +182,7 @@ def prober(my_history, opponent_history):
 
 # Look at last 5 moves of opponent and check how much they cooperate. If they
 # cooperate more than 60% of the time, also cooperate, else defect.
+@finite_memory(5)
 def adaptive_ratio(my_history, opponent_history):
     recent = opponent_history[-5:] if len(opponent_history) >= 5 else opponent_history
     if not recent:
@@ -118,3 +203,326 @@ non_genetic_strategies = {
     "Prober": prober,
     "Adaptive Ratio": adaptive_ratio
 }
+
+
+# Incremental equivalents of the strategies above, which keep their own O(1)
+# state instead of scanning the full histories every round. reset() is called
+# at the start of every match and move(last_own, last_opponent) receives the
+# moves of the previous round (None in the first round).
+@finite_memory(0)
+@markov(0, lambda my_last, opponent_last: 1.0)
+class AlwaysCooperate:
+    def reset(self):
+        pass
+
+    def move(self, last_own, last_opponent):
+        return COOPERATE
+
+
+@finite_memory(0)
+@markov(0, lambda my_last, opponent_last: 0.0)
+class AlwaysDefect:
+    def reset(self):
+        pass
+
+    def move(self, last_own, last_opponent):
+        return DEFECT
+
+
+@finite_memory(1)
+@markov(1, lambda my_last, opponent_last: 0.0 if DEFECT in opponent_last else 1.0)
+class TitForTat:
+    def reset(self):
+        pass
+
+    def move(self, last_own, last_opponent):
+        return last_opponent or COOPERATE
+
+
+@finite_memory(1)
+@markov(1, lambda my_last, opponent_last: 0.0 if DEFECT in my_last + opponent_last else 1.0)
+class GrimTrigger:
+    def reset(self):
+        self.triggered = False
+
+    def move(self, last_own, last_opponent):
+        if last_opponent == DEFECT:
+            self.triggered = True
+        return DEFECT if self.triggered else COOPERATE
+
+
+@finite_memory(1)
+@payoff_dependent
+@markov(1, win_stay_lose_shift_probability)
+class WinStayLoseShift:
+    def reset(self):
+        pass
+
+    def move(self, last_own, last_opponent):
+        if last_own is None:
+            return COOPERATE
+
+        last_payoff, _ = payoff_matrix[(last_own, last_opponent)]
+        if last_payoff >= 3:
+            return last_own
+        else:
+            return DEFECT if last_own == COOPERATE else COOPERATE
+
+
+@markov(0, lambda my_last, opponent_last: 0.5)
+class RandomStrategy:
+    def reset(self):
+        pass
+
+    def move(self, last_own, last_opponent):
+        return random.choice([COOPERATE, DEFECT])
+
+
+@markov(1, lambda my_last, opponent_last: 0.7 if DEFECT in opponent_last else 1.0)
+class GenerousTitForTat:
+    def reset(self):
+        pass
+
+    def move(self, last_own, last_opponent):
+        if last_opponent == DEFECT:
+            return COOPERATE if random.random() < 0.7 else DEFECT
+        return COOPERATE
+
+
+@finite_memory(0, period=4)
+class DoubleAlternator:
+    def reset(self):
+        self.round_number = 0
+
+    def move(self, last_own, last_opponent):
+        round_number = self.round_number
+        self.round_number += 1
+        return COOPERATE if round_number % 4 in (0, 1) else DEFECT
+
+
+@finite_memory(1, warmup=5)
+class Prober:
+    def reset(self):
+        self.round_number = 0
+        self.probe_answer = None
+
+    def move(self, last_own, last_opponent):
+        round_number = self.round_number
+        self.round_number += 1
+
+        if round_number < 4:
+            return COOPERATE
+        elif round_number == 4:
+            return DEFECT
+
+        # Remember how the opponent answered the probe in round 4
+        if round_number == 5:
+            self.probe_answer = last_opponent
+        if self.probe_answer == DEFECT:
+            return DEFECT
+        return last_opponent
+
+
+@finite_memory(5)
+class AdaptiveRatio:
+    def reset(self):
+        self.recent = deque(maxlen=5)
+        self.cooperations = 0
+
+    def move(self, last_own, last_opponent):
+        if last_opponent is None:
+            return COOPERATE
+
+        # Keep a running count of cooperations in the last 5 moves
+        if len(self.recent) == 5 and self.recent[0] == COOPERATE:
+            self.cooperations -= 1
+        self.recent.append(last_opponent)
+        if last_opponent == COOPERATE:
+            self.cooperations += 1
+
+        cooperation_ratio = self.cooperations / len(self.recent)
+        return COOPERATE if cooperation_ratio >= 0.6 else DEFECT
+
+
+# Maps every non-genetic strategy to its incremental equivalent
+incremental_strategies = {
+    always_cooperate: AlwaysCooperate,
+    always_defect: AlwaysDefect,
+    tit_for_tat: TitForTat,
+    grim_trigger: GrimTrigger,
+    win_stay_lose_shift: WinStayLoseShift,
+    random_strategy: RandomStrategy,
+    generous_tit_for_tat: GenerousTitForTat,
+    double_alternator: DoubleAlternator,
+    prober: Prober,
+    adaptive_ratio: AdaptiveRatio
+}
+
+
+# Vectorized equivalents of the strategies above, used to play a whole batch of
+# matches in lock-step. Moves are arrays of 0 (COOPERATE) and 1 (DEFECT), one
+# entry per match. reset(size) prepares a batch of `size` matches and
+# move(my_last, opponent_last) receives the moves of the previous round (None
+# in the first round) and returns the moves for the current round.
+class VectorAlwaysCooperate:
+    def reset(self, size):
+        self.moves = numpy.zeros(size, dtype=numpy.uint8)
+
+    def move(self, my_last, opponent_last):
+        return self.moves
+
+
+class VectorAlwaysDefect:
+    def reset(self, size):
+        self.moves = numpy.ones(size, dtype=numpy.uint8)
+
+    def move(self, my_last, opponent_last):
+        return self.moves
+
+
+class VectorTitForTat:
+    def reset(self, size):
+        self.size = size
+
+    def move(self, my_last, opponent_last):
+        if opponent_last is None:
+            return numpy.zeros(self.size, dtype=numpy.uint8)
+        return opponent_last.copy()
+
+
+class VectorGrimTrigger:
+    def reset(self, size):
+        self.triggered = numpy.zeros(size, dtype=numpy.uint8)
+
+    def move(self, my_last, opponent_last):
+        if opponent_last is not None:
+            self.triggered |= opponent_last
+        return self.triggered.copy()
+
+
+class VectorWinStayLoseShift:
+    def reset(self, size):
+        self.size = size
+        # Payoff of the last outcome indexed by (my move, opponent move)
+        self.payoffs = numpy.array([[payoff_matrix[(my_move, opponent_move)][0]
+                                     for opponent_move in (COOPERATE, DEFECT)]
+                                    for my_move in (COOPERATE, DEFECT)])
+
+    def move(self, my_last, opponent_last):
+        if my_last is None:
+            return numpy.zeros(self.size, dtype=numpy.uint8)
+        stay = self.payoffs[my_last, opponent_last] >= 3
+        return numpy.where(stay, my_last, my_last ^ 1).astype(numpy.uint8)
+
+
+# The stochastic strategies optionally take pre-drawn uniform numbers, one per
+# round, that all matches of the batch share (common random numbers). Every
+# match then meets the same luck, so differences in score come from the
+# other player only. Without them every match draws its own numbers.
+class VectorRandomStrategy:
+    def __init__(self, draws=None):
+        self.draws = draws
+
+    def reset(self, size):
+        self.size = size
+        self.round_number = 0
+        # Seed from the random module so random.seed keeps runs reproducible
+        if self.draws is None:
+            self.rng = numpy.random.default_rng(random.getrandbits(64))
+
+    def move(self, my_last, opponent_last):
+        if self.draws is None:
+            return self.rng.integers(0, 2, self.size, dtype=numpy.uint8)
+        draw = self.draws[self.round_number]
+        self.round_number += 1
+        return numpy.full(self.size, draw >= 0.5, dtype=numpy.uint8)
+
+
+class VectorGenerousTitForTat:
+    def __init__(self, draws=None):
+        self.draws = draws
+
+    def reset(self, size):
+        self.size = size
+        self.round_number = 0
+        if self.draws is None:
+            self.rng = numpy.random.default_rng(random.getrandbits(64))
+
+    def move(self, my_last, opponent_last):
+        round_number = self.round_number
+        self.round_number += 1
+        if opponent_last is None:
+            return numpy.zeros(self.size, dtype=numpy.uint8)
+        if self.draws is None:
+            unforgiven = self.rng.random(self.size) >= 0.7
+            return (opponent_last & unforgiven).astype(numpy.uint8)
+        if self.draws[round_number] >= 0.7:
+            return opponent_last.copy()
+        return numpy.zeros(self.size, dtype=numpy.uint8)
+
+
+class VectorDoubleAlternator:
+    def reset(self, size):
+        self.size = size
+        self.round_number = 0
+
+    def move(self, my_last, opponent_last):
+        move = 0 if self.round_number % 4 in (0, 1) else 1
+        self.round_number += 1
+        return numpy.full(self.size, move, dtype=numpy.uint8)
+
+
+class VectorProber:
+    def reset(self, size):
+        self.size = size
+        self.round_number = 0
+        self.probe_answer = None
+
+    def move(self, my_last, opponent_last):
+        round_number = self.round_number
+        self.round_number += 1
+
+        if round_number < 4:
+            return numpy.zeros(self.size, dtype=numpy.uint8)
+        elif round_number == 4:
+            return numpy.ones(self.size, dtype=numpy.uint8)
+
+        # Remember how the opponent answered the probe in round 4
+        if round_number == 5:
+            self.probe_answer = opponent_last.copy()
+        return self.probe_answer | opponent_last
+
+
+class VectorAdaptiveRatio:
+    def reset(self, size):
+        self.recent = numpy.zeros((5, size), dtype=numpy.uint8)
+        self.round_number = 0
+
+    def move(self, my_last, opponent_last):
+        if opponent_last is None:
+            self.round_number = 1
+            return numpy.zeros(self.recent.shape[1], dtype=numpy.uint8)
+
+        # Keep the last 5 moves of the opponent in a ring buffer
+        self.recent[(self.round_number - 1) % 5] = opponent_last
+        window = min(self.round_number, 5)
+        self.round_number += 1
+
+        cooperations = window - self.recent[:window].sum(axis=0)
+        cooperation_ratio = cooperations / window
+        return (cooperation_ratio < 0.6).astype(numpy.uint8)
+
+
+# Maps every non-genetic strategy to its vectorized equivalent
+vectorized_strategies = {
+    always_cooperate: VectorAlwaysCooperate,
+    always_defect: VectorAlwaysDefect,
+    tit_for_tat: VectorTitForTat,
+    grim_trigger: VectorGrimTrigger,
+    win_stay_lose_shift: VectorWinStayLoseShift,
+    random_strategy: VectorRandomStrategy,
+    generous_tit_for_tat: VectorGenerousTitForTat,
+    double_alternator: VectorDoubleAlternator,
+    prober: VectorProber,
+    adaptive_ratio: VectorAdaptiveRatio
+}
@@ -5,7 +5,8 @@ Description:
 This script runs an Iterated Prisoner's Dilemma simulation with a GUI,
 allowing users to use different strategies in a tournament.
 """
-from ipd_simulation.simulation_gui import IPDSimulation, IPDGUI
+from ipd_simulation.simulation import IPDSimulation
+from ipd_simulation.simulation_gui import IPDGUI
 
 
 init_params = {
@@ -13,9 +13,18 @@
 #   >>> import pyics.paramsweep
 # etc.
 
-from .pycx_gui import GUI
 from .model import Model
 from .paramsweep import paramsweep
 
+# The GUI pulls in tkinter and selects the TkAgg backend of matplotlib, which
+# is slow and fails without a display. It is therefore only imported when
+# `pyics.GUI' is first used, so models and sweeps can run headless.
+def __getattr__(name):
+    if name == 'GUI':
+        from .pycx_gui import GUI
+        globals()['GUI'] = GUI
+        return GUI
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 # When importing everything (from pyics import *) limit it so useful stuff.
 __all__ = ['GUI', 'Model', 'paramsweep']
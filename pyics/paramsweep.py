@@ -5,6 +5,9 @@
 
 import csv
 import itertools
+import multiprocessing
+import os
+import random
 import numpy
 
 STR_TYPES = (bytes, str)
@@ -35,8 +38,99 @@ def get_measurement(model, attr):
             m = m()
         return m
 
+def run_once(model, params, measure_attrs, max_iter, measure_interval):
+    """Sets `params' on `model', runs it once and returns the measurements of
+    this run: a list with, for every attribute in `measure_attrs', the list of
+    values measured during the run."""
+
+    for pn, pv in params.items():
+        setattr(model, pn, pv)
+
+    model.reset()
+    current_iter = 0
+    series = [[] for a in measure_attrs]
+    if measure_interval:
+        for m, attr in zip(series, measure_attrs):
+            m.append(get_measurement(model, attr))
+    # Run the model (recording measurements) until model indicates
+    # simulation has finished or we reach the max number of iters.
+    while model.step() is not True and \
+            (not max_iter or current_iter < max_iter):
+        current_iter += 1
+        if measure_interval and current_iter % measure_interval == 0:
+            for m, attr in zip(series, measure_attrs):
+                m.append(get_measurement(model, attr))
+    if not measure_interval:
+        for m, attr in zip(series, measure_attrs):
+            m.append(get_measurement(model, attr))
+    return series
+
+# Settings of the sweep in a worker process. They are handed over once when the
+# worker starts, so measurement lambdas never have to be pickled per task.
+worker_sweep = None
+
+def init_sweep_worker(sweep):
+    global worker_sweep
+    worker_sweep = sweep
+    # Forked workers inherit the random state, give each its own stream
+    random.seed()
+    numpy.random.seed()
+
+def sweep_task(run):
+    """Runs a single (combination, repetition) task on a fresh model and
+    returns it with its measurements, as (param values, rep_num, series)."""
+    model_class, base_params, param_names, measure_attrs, max_iter, \
+        measure_interval = worker_sweep
+    vals, r = run
+    model = model_class()
+    run_params = dict(base_params)
+    run_params.update(zip(param_names, vals))
+    return vals, r, run_once(model, run_params, measure_attrs, max_iter,
+                             measure_interval)
+
+def completed_runs(filenames, param_names):
+    """Returns the (param values, rep_num) keys of the runs present in every
+    csv file of an earlier sweep, as strings like they are stored.
+
+    A row cut off by a crash is removed, and rows of runs missing from one of
+    the files are dropped, so these runs are simply run again."""
+
+    key_length = len(param_names) + 1
+    completed = None
+    for fn in filenames:
+        with open(fn, 'rb+') as f:
+            data_end = f.seek(0, os.SEEK_END)
+            while data_end > 0:
+                f.seek(data_end - 1)
+                if f.read(1) == b'\n':
+                    break
+                data_end -= 1
+            f.truncate(data_end)
+        with open(fn, newline='') as f:
+            keys = set(tuple(row[:key_length]) for row in
+                       itertools.islice(csv.reader(f), 1, None))
+        completed = keys if completed is None else completed & keys
+
+    for fn in filenames:
+        # Rewrite the file line by line, only when it has rows to drop
+        with open(fn, newline='') as f:
+            rows = itertools.islice(csv.reader(f), 1, None)
+            if all(tuple(row[:key_length]) in completed for row in rows):
+                continue
+        with open(fn, newline='') as f, \
+                open(fn + '.tmp', 'w', newline='') as out:
+            reader, writer = csv.reader(f), csv.writer(out)
+            writer.writerow(next(reader))
+            for row in reader:
+                if tuple(row[:key_length]) in completed:
+                    writer.writerow(row)
+        os.replace(fn + '.tmp', fn)
+
+    return completed
+
 def paramsweep(model, repetitions, param_space, measure_attrs, max_iter=0,
-               csv_base_filename=None, measure_interval=1):
+               csv_base_filename=None, measure_interval=1, workers=1,
+               resume=False, return_measurements=True):
     """Performs a parameter sweep over Model instance `model', setting the
     parameters defined in the dictionary `param_space', each combination
     `repetitions' times, and outputs all measurements as defined by
@@ -60,7 +154,24 @@ def paramsweep(model, repetitions, param_space, measure_attrs, max_iter=0,
     csv file is created (e.g. "%s_%d.csv" % (csv_base_filename, measurement) for
     every measurement). In this file every row contains a single executions (and
     thus per column the iterations). Note that the first columns will contain
-    the parameter values and the repetition number.
+    the parameter values and the repetition number. Every row is written as
+    soon as its run finishes, so a crashed sweep keeps all finished runs. With
+    workers the rows are in the order the runs finish, the returned
+    measurements are always in sweep order.
+
+    With `workers' other than 1 the runs are divided over that many worker
+    processes (0 uses all cores). Every run then gets a fresh instance of the
+    class of `model', with the current parameter values of `model' as
+    defaults. The measurement attributes may be lambdas, but the measured
+    values have to be picklable.
+
+    With `resume' set, runs already present in the csv files of an earlier
+    sweep with the same `csv_base_filename' are skipped, and the new runs are
+    appended. Only the measurements of the new runs are returned then.
+
+    With `return_measurements' set to False the measurements are not kept in
+    memory and None is returned, so a sweep to csv uses the same amount of
+    memory regardless of its size.
 
         >>> from some_sim import Sim
         >>> mysim = Sim()
@@ -78,46 +189,71 @@ def paramsweep(model, repetitions, param_space, measure_attrs, max_iter=0,
     param_values = (i[1] if isinstance(i[1], accepted_iterables) else (i[1],)
                     for i in param_list)
 
-    combinations = tuple(itertools.product(*param_values))
-    measurements = [[] for a in measure_attrs]
-    # Iterate over all combinations of parameter values
-    for vals in combinations:
-        # Set current parameter values to the model
-        for pn, pv in zip(param_names, vals):
-            if pn not in model.params:
-                raise ValueError(("param '%s' not a parameter of model (known "
-                        "params: %s)") % (pn, ', '.join(model.params)))
-            setattr(model, pn, pv)
-
-        # Perform simulations requested amount of times with current params.
-        for r in range(repetitions):
-            model.reset()
-            current_iter = 0
-            if measure_interval:
-                for m, attr in zip(measurements, measure_attrs):
-                    m.append([get_measurement(model, attr)])
-            # Run the model (recording measurements) until model indicates
-            # simulation has finished or we reach the max number of iters.
-            while model.step() is not True and \
-                    (not max_iter or current_iter < max_iter):
-                current_iter += 1
-                if measure_interval and current_iter % measure_interval == 0:
-                    for i, attr in enumerate(measure_attrs):
-                        m = get_measurement(model, attr)
-                        measurements[i][-1].append(m)
-            if not measure_interval:
-                for m, attr in zip(measurements, measure_attrs):
-                    m.append([get_measurement(model, attr)])
+    for pn in param_names:
+        if pn not in model.params:
+            raise ValueError(("param '%s' not a parameter of model (known "
+                    "params: %s)") % (pn, ', '.join(model.params)))
 
+    filenames = []
     if csv_base_filename is not None:
-        # Dump results to csv files: one per measurement, row per run
-        for i, m in enumerate(measurements):
-            with open('%s_%d.csv' % (csv_base_filename, i), 'w') as f:
-                writer = csv.writer(f)
-                writer.writerow(param_names + ["rep_num"])
-                for j, n in enumerate(m):
-                    params = combinations[j // repetitions]
-                    rep = j % repetitions
-                    writer.writerow(list(params) + [rep, None] + n)
+        filenames = ['%s_%d.csv' % (csv_base_filename, i)
+                     for i in range(len(measure_attrs))]
+    resume = resume and bool(filenames) and \
+        all(os.path.exists(fn) for fn in filenames)
+    completed = completed_runs(filenames, param_names) if resume else set()
 
+    # Every (combination, repetition) that still has to run, in sweep order
+    runs = [(vals, r) for vals in itertools.product(*param_values)
+            for r in range(repetitions)
+            if tuple(str(v) for v in vals) + (str(r),) not in completed]
+
+    pool = None
+    if workers == 1:
+        results = ((vals, r, run_once(model, dict(zip(param_names, vals)),
+                                      measure_attrs, max_iter,
+                                      measure_interval))
+                   for vals, r in runs)
+    else:
+        base_params = dict((pn, getattr(model, pn)) for pn in model.params)
+        sweep = (model.__class__, base_params, param_names, measure_attrs,
+                 max_iter, measure_interval)
+        pool = multiprocessing.Pool(workers or os.cpu_count(),
+                                    initializer=init_sweep_worker,
+                                    initargs=(sweep,))
+        results = pool.imap_unordered(sweep_task, runs)
+
+    # Measurements by the position of their run in the sweep
+    measured = {}
+    files = []
+    try:
+        for fn in filenames:
+            f = open(fn, 'a' if resume else 'w', newline='')
+            files.append(f)
+            if not resume:
+                csv.writer(f).writerow(param_names + ["rep_num"])
+                f.flush()
+
+        # Every run is written as soon as it finishes, which with workers is
+        # not necessarily in sweep order. Resume finds runs by their key, not
+        # by their position in the files
+        positions = dict((run, i) for i, run in enumerate(runs))
+        for vals, r, series in results:
+            for f, n in zip(files, series):
+                csv.writer(f).writerow(list(vals) + [r, None] + n)
+                f.flush()
+            if return_measurements:
+                measured[positions[(vals, r)]] = series
+    finally:
+        for f in files:
+            f.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if not return_measurements:
+        return None
+    measurements = [[] for a in measure_attrs]
+    for i in sorted(measured):
+        for m, n in zip(measurements, measured[i]):
+            m.append(n)
     return measurements
@@ -25,12 +25,19 @@
 ## Dick van Albada, G.D.vanAlbada@uva.nl
 ## Added plt.show() to drawModel() to force actual display of the plot
 ##
+## Models are stepped in a background thread, so the window stays responsive
+## during heavy steps. The thread reports back through a message queue which
+## the Tk main loop polls; see `post' and `handleMessage'.
+##
 ## The matplotlib backend will be automatically selected based on your OS when
 ## this file is first imported. It is therefore important that matplotlib.pyplot
 ## imported *after* this file. A clean way do to this is to import pyplot
 ## locally in the draw function of your model only.
 
+import queue
 import sys
+import threading
+import time
 
 import matplotlib
 matplotlib.use('TkAgg')
@@ -56,6 +63,19 @@ class GUI:
         self.modelFigure = None
         self.currentStep = 0
 
+        # Background thread stepping the model. It waits while `paused' is
+        # set or no `stepsLeft' remain (None runs until the model finishes),
+        # and posts 'stopped' and returns once `stopRequested' is set.
+        # Everything it wants to show is posted on `messages'.
+        self.messages = queue.Queue()
+        self.worker = None
+        self.control = threading.Condition()
+        self.paused = True
+        self.stepsLeft = 0
+        self.stopRequested = False
+        self.resetting = False
+        self.pollInterval = 50
+
         self.initGUI()
 
     def initGUI(self):
@@ -191,7 +211,7 @@ class GUI:
     def runEvent(self):
         if not self.running:
             self.running = True
-            self.rootWindow.after(self.timeInterval, self.stepModel)
+            self.startWorker(None)
             self.runPauseString.set("Pause")
             self.buttonStep.configure(state=DISABLED)
             if self.param_entries:
@@ -202,6 +222,8 @@ class GUI:
 
     def stopRunning(self):
         self.running = False
+        # The worker pauses at its next check, after the current step
+        self.setControl(paused=True)
         self.runPauseString.set("Continue Run")
         self.buttonStep.configure(state=NORMAL)
         self.drawModel()
@@ -209,33 +231,124 @@ class GUI:
             self.buttonSaveParameters.configure(state=NORMAL)
             self.buttonSaveParametersAndReset.configure(state=NORMAL)
 
-    def stepModel(self):
-        if self.running:
-            if self.model.step() is True:
-                self.stopRunning()
+    #background execution
+    def setControl(self, **state):
+        with self.control:
+            for name, value in state.items():
+                setattr(self, name, value)
+            self.control.notify_all()
+
+    def startWorker(self, steps):
+        """Steps the model in the background thread, `steps' times or until
+        the model finishes when `steps' is None."""
+        self.setControl(paused=False, stepsLeft=steps)
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.runWorker, daemon=True)
+            self.worker.start()
+
+    def runWorker(self):
+        while True:
+            with self.control:
+                while not self.stopRequested and \
+                        (self.paused or self.stepsLeft == 0):
+                    self.control.wait()
+                if self.stopRequested:
+                    self.post('stopped')
+                    return
+                if self.stepsLeft is not None:
+                    self.stepsLeft -= 1
+
+            try:
+                finished = self.model.step() is True
+            except Exception as error:
+                # Keep the thread alive, the user can still reset the model
+                self.setControl(paused=True)
+                self.post('error', error)
+                continue
+            self.post('step', finished)
+            if finished:
+                self.setControl(paused=True)
+            elif self.timeInterval:
+                time.sleep(self.timeInterval / self.stepSize / 1000.0)
+
+    def stopWorker(self):
+        """Asks the background thread to stop after its current step. Returns
+        True when it already stopped; otherwise it posts 'stopped' later."""
+        if self.worker is None:
+            return True
+        self.setControl(stopRequested=True)
+        return False
+
+    def post(self, kind, value=None):
+        """Queues a message for the Tk main loop; safe from any thread."""
+        self.messages.put((kind, value))
+
+    def pollMessages(self):
+        stepped = False
+        while not self.messages.empty():
+            kind, value = self.messages.get_nowait()
+            if kind == 'stopped':
+                self.worker = None
+                self.setControl(paused=True, stepsLeft=0, stopRequested=False)
+                if self.resetting:
+                    self.finishReset()
+            elif not self.resetting:
+                # Messages of a worker being stopped for a reset are stale
+                stepped = self.handleMessage(kind, value) or stepped
+        if stepped:
+            self.drawModel()
+        self.rootWindow.after(self.pollInterval, self.pollMessages)
+
+    def handleMessage(self, kind, value):
+        """Handles a message posted by the worker. Returns True when the model
+        should be redrawn. Subclasses can handle their own kinds of messages."""
+        if kind == 'step':
             self.currentStep += 1
             self.setStatusStr("Step " + str(self.currentStep))
             self.status.configure(foreground='black')
-            if (self.currentStep) % self.stepSize == 0:
-                self.drawModel()
-            self.rootWindow.after(int(self.timeInterval * 1.0 / self.stepSize),
-                                  self.stepModel)
+            if value is True and self.running:
+                self.stopRunning()
+                return False
+            return not self.running or self.currentStep % self.stepSize == 0
+        if kind == 'error':
+            if self.running:
+                self.stopRunning()
+            self.setStatusStr("Error in step %d: %r" % (self.currentStep + 1,
+                                                         value))
+            self.status.configure(foreground='red')
+        return False
 
     def stepOnce(self):
         self.running = False
         self.runPauseString.set("Continue Run")
-        self.model.step()
-        self.currentStep += 1
-        self.setStatusStr("Step " + str(self.currentStep))
-        self.drawModel()
+        self.startWorker(1)
         if self.param_entries:
             self.buttonSaveParameters.configure(state=NORMAL)
 
     def resetModel(self):
+        """Resets the model once the background thread has stopped. The Tk
+        main loop keeps running meanwhile; `pollMessages' finishes the reset
+        when the thread reports it stopped."""
         self.running = False
         self.runPauseString.set("Run")
+        if self.stopWorker():
+            self.finishReset()
+            return
+        self.resetting = True
+        self.setStatusStr("Resetting after the current step...")
+        for button in (self.buttonRun, self.buttonStep, self.buttonReset):
+            button.configure(state=DISABLED)
+        if self.param_entries:
+            self.buttonSaveParametersAndReset.configure(state=DISABLED)
+
+    def finishReset(self):
+        self.resetting = False
         self.model.reset()
         self.currentStep = 0
+        for button in (self.buttonRun, self.buttonStep, self.buttonReset):
+            button.configure(state=NORMAL)
+        if self.param_entries:
+            self.buttonSaveParametersAndReset.configure(state=NORMAL)
         self.setStatusStr("Model has been reset")
         self.drawModel()
 
@@ -262,9 +375,11 @@ class GUI:
 
         self.model.reset()
         self.drawModel()
+        self.rootWindow.after(self.pollInterval, self.pollMessages)
         self.rootWindow.mainloop()
 
     def quitGUI(self):
+        self.setControl(stopRequested=True)
         plt.close('all')
         self.rootWindow.quit()
         self.rootWindow.destroy()